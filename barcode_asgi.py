@@ -0,0 +1,526 @@
+"""ASGI entry point: barcode_gen's routes and JSON contracts, served with asyncio.
+
+    gunicorn -k uvicorn_worker.UvicornWorker barcode_asgi:app   (start_async.sh)
+
+A sync worker blocks on the storage upload and the DB commit, so it holds one
+request at a time. Here uploads go through a pooled httpx.AsyncClient, DB
+access through a psycopg 3 AsyncConnectionPool, and rendering runs in the
+render process pool (BATCH_RENDER_WORKERS) or a thread, so one worker keeps
+hundreds of requests in flight while the render cores stay busy.
+
+Configuration, rendering, caches, SQL and response bodies come from
+barcode_gen. Streaming exports and the write-behind workers reuse its
+synchronous implementation on threads. Slow-request cProfile sampling is not
+available: a profiler would see every request interleaved on the event loop.
+"""
+import asyncio
+import functools
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+
+import httpx
+from psycopg_pool import AsyncConnectionPool
+from qrcode.exceptions import DataOverflowError
+from quart import Quart, Response, g, jsonify, request
+
+import barcode_gen as bg
+import metrics
+from db import AsyncGroupCommitWriter
+
+ASYNC_STORAGE_CONNECTIONS = int(os.getenv("ASYNC_STORAGE_CONNECTIONS", "100"))
+ASYNC_STORAGE_TIMEOUT = float(os.getenv("ASYNC_STORAGE_TIMEOUT", "30"))
+ASYNC_DB_POOL_MAX = int(os.getenv("ASYNC_DB_POOL_MAX", str(bg.DB_POOL_MAX)))
+
+app = Quart(__name__)
+
+storage = None
+db_pool = None
+barcode_writer = None
+qr_writer = None
+
+
+class AsyncStorage:
+    """Supabase Storage REST client on one pooled, keep-alive httpx.AsyncClient."""
+
+    def __init__(self, url, key, max_connections, timeout):
+        self.client = httpx.AsyncClient(
+            base_url=f"{url}/storage/v1",
+            headers={"Authorization": f"Bearer {key}", "apikey": key},
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=timeout,
+        )
+
+    async def upload(self, bucket, path, data, content_type, upsert=False):
+        response = await self.client.post(
+            f"/object/{bucket}/{path}",
+            content=data,
+            headers={"Content-Type": content_type, "x-upsert": "true" if upsert else "false"},
+        )
+        response.raise_for_status()
+
+    async def download(self, bucket, path):
+        response = await self.client.get(f"/object/{bucket}/{path}")
+        response.raise_for_status()
+        return response.content
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class MeteredPool:
+    """Wraps an AsyncConnectionPool so checkouts show up in barcode_db_pool_in_use."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    @asynccontextmanager
+    async def connection(self):
+        async with self.pool.connection() as conn:
+            metrics.DB_POOL_IN_USE.inc()
+            try:
+                yield conn
+            finally:
+                metrics.DB_POOL_IN_USE.dec()
+
+
+def row_insert_sql(kind):
+    """INSERT with one row's placeholders, for executemany."""
+    table, columns = bg.insert_columns(kind)
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) ON CONFLICT DO NOTHING"
+
+
+@app.before_serving
+async def open_clients():
+    # Runs in each worker after the fork, inside its event loop.
+    global storage, db_pool, barcode_writer, qr_writer
+    started = time.monotonic()
+    storage = AsyncStorage(bg.SUPABASE_URL, bg.SUPABASE_KEY, ASYNC_STORAGE_CONNECTIONS, ASYNC_STORAGE_TIMEOUT)
+    pool = AsyncConnectionPool(
+        kwargs={key: value for key, value in bg.DB_CONFIG.items() if value is not None},
+        min_size=bg.DB_POOL_MIN, max_size=ASYNC_DB_POOL_MAX, open=False,
+    )
+    await pool.open()
+    db_pool = MeteredPool(pool)
+    metrics.DB_POOL_MAX.set(ASYNC_DB_POOL_MAX)
+    barcode_writer = AsyncGroupCommitWriter(db_pool, row_insert_sql("barcode"), max_delay=bg.DB_GROUP_COMMIT_DELAY)
+    qr_writer = AsyncGroupCommitWriter(db_pool, row_insert_sql("qr"), max_delay=bg.DB_GROUP_COMMIT_DELAY)
+    bg.clients_opened(started)
+
+
+@app.after_serving
+async def close_clients():
+    await storage.aclose()
+    await db_pool.pool.close()
+
+
+async def run_render(function, *args):
+    """Runs a CPU-bound render off the event loop."""
+    loop = asyncio.get_running_loop()
+    render_pool = bg.get_render_pool()
+    if render_pool is not None:
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(render_pool, function, *args), bg.BATCH_RENDER_TIMEOUT)
+        except (BrokenProcessPool, asyncio.TimeoutError) as e:
+            print(f"Render pool unavailable, rendering on a thread: {e!r}")
+            bg.drop_render_pool(render_pool)
+    return await loop.run_in_executor(None, function, *args)
+
+
+async def upload_to_supabase(rendered, unique_id, bucket, upsert=False):
+    try:
+        with metrics.STAGE_SECONDS.labels("upload").time(), metrics.UPLOADS_IN_FLIGHT.track_inprogress():
+            await storage.upload(bucket, f"static/{unique_id}.{rendered.extension}", rendered.data,
+                                 rendered.content_type, upsert)
+        return bg.public_url(unique_id, bucket, rendered.extension)
+    except Exception as e:
+        metrics.STAGE_FAILURES.labels("upload").inc()
+        print(f"Error uploading to Supabase: {e}")
+        return None
+
+
+async def store_code_in_db(kind, name, unique_id, url, rendered, render_options=None):
+    writer = barcode_writer if kind == "barcode" else qr_writer
+    stage = f"store_{kind}"
+    with metrics.STAGE_SECONDS.labels(stage).time():
+        stored = await writer.write(bg.image_row(kind, name, unique_id, url, rendered, render_options, binary=bytes))
+    if not stored:
+        metrics.STAGE_FAILURES.labels(stage).inc()
+    return stored
+
+
+async def store_qr_batch_in_db(items):
+    """Inserts (name, unique_id, qr_url, rendered) rows in one transaction."""
+    if not items:
+        return True
+    try:
+        with metrics.STAGE_SECONDS.labels("store_qr_batch").time():
+            async with db_pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.executemany(row_insert_sql("qr"), [
+                        bg.image_row("qr", name, unique_id, qr_url, rendered, binary=bytes)
+                        for name, unique_id, qr_url, rendered in items
+                    ])
+        return True
+    except Exception as e:
+        metrics.STAGE_FAILURES.labels("store_qr_batch").inc()
+        print(f"Database Error (QR Code batch): {e}")
+        return False
+
+
+async def fetch_row(sql, params):
+    async with db_pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(sql, params)
+            return await cur.fetchone()
+
+
+# Batch Generation
+
+async def generate_batch(name, quantity, render, bucket, store_batch=None):
+    """Async generate_batch(): renders off the loop, uploads concurrently."""
+    # generate_unique_id() never sleeps (it steps past the last millisecond
+    # handed out), so making the ids here does not block the loop.
+    unique_ids = [bg.generate_unique_id(name) for _ in range(quantity)]
+    uploads = asyncio.Semaphore(bg.BATCH_UPLOAD_CONCURRENCY)
+
+    async def generate(unique_id):
+        try:
+            rendered = await run_render(render, unique_id)
+        except Exception as e:
+            return unique_id, None, None, f"Failed to render: {e}"
+        async with uploads:
+            url = await upload_to_supabase(rendered, unique_id, bucket)
+        if not url:
+            return unique_id, rendered, None, "Failed to upload"
+        return unique_id, rendered, url, None
+
+    results = await asyncio.gather(*(generate(unique_id) for unique_id in unique_ids))
+    uploaded = [(unique_id, rendered, url) for unique_id, rendered, url, error in results if not error]
+    failed = [(unique_id, error) for unique_id, _, _, error in results if error]
+
+    if store_batch and not await store_batch([(name, unique_id, url, rendered) for unique_id, rendered, url in uploaded]):
+        failed = [(unique_id, error or "Failed to store in database") for unique_id, _, _, error in results]
+        return [], failed
+    return [(unique_id, url) for unique_id, _, url in uploaded], failed
+
+
+async def iterate_in_thread(iterator):
+    """Drains a blocking iterator on the default executor, one item at a time."""
+    loop = asyncio.get_running_loop()
+    done = object()
+    while True:
+        item = await loop.run_in_executor(None, next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+async def quantity_api(render, bucket, store_batch, sync_store_batch, key, url_key, label):
+    data = await request.get_json()
+    name = data.get("name")
+    quantity = data.get("quantity")
+
+    if not name or not quantity:
+        return jsonify({"isSuccess": False, "message": "Missing required fields"}), 400
+    if not isinstance(quantity, int) or quantity < 1:
+        return jsonify({"isSuccess": False, "message": "quantity must be a positive integer"}), 400
+
+    export_format = data.get("export")
+    if export_format:
+        if export_format not in bg.EXPORT_FORMATS:
+            return jsonify({"isSuccess": False, "message": f"export must be one of {', '.join(bg.EXPORT_FORMATS)}"}), 400
+        body, mimetype, filename = bg.export_body(name, quantity, render, bucket, sync_store_batch,
+                                                  export_format, url_key, key)
+        return Response(iterate_in_thread(body), mimetype=mimetype, headers=bg.export_headers(filename))
+
+    succeeded, failed = await generate_batch(name, quantity, render, bucket, store_batch)
+    body, status = bg.batch_result(succeeded, failed, key, url_key, label)
+    return jsonify(body), status
+
+
+@app.route('/generate_barcode', methods=['POST'])
+async def generate_barcode_api():
+    return await quantity_api(bg.render_barcode, bg.SUPABASE_BUCKET, None, None,
+                              "barcodes", "barcode_image_path", "Barcodes")
+
+
+@app.route('/generate_qrcode', methods=['POST'])
+async def generate_qr_api():
+    return await quantity_api(bg.render_qr_code, bg.QR_SUPABASE_BUCKET, store_qr_batch_in_db, bg.store_qr_batch_in_db,
+                              "qr_codes", "qr_code_image_path", "QR Codes")
+
+
+# Result Cache
+
+async def lookup_code_in_db(kind, value, render):
+    try:
+        row = await fetch_row(bg.lookup_sql(kind), (value, value))
+        if not row:
+            return None
+        unique_id, url, image = row
+        if image is None:
+            return unique_id, url, await run_render(functools.partial(render, fmt=bg.url_format(url)), value)
+        return unique_id, url, bg.RenderedImage.from_stored(image, url)
+    except Exception as e:
+        print(f"Database Error (cache lookup): {e}")
+        return None
+
+
+async def write_behind_result_live(unique_id):
+    """Async bg.write_behind_result_live(): only asks the spool (off the loop) for unsettled jobs."""
+    if not bg.write_behind_unsettled(unique_id):
+        return True
+    return await asyncio.get_running_loop().run_in_executor(None, bg.write_behind_result_live, unique_id)
+
+
+async def get_cached_code(symbology, kind, value, options, render):
+    """Async get_cached_code(): (unique_id, url, rendered) from either tier, or None."""
+    key = (symbology, value, options)
+    entry = bg.result_cache.get(key)
+    if entry is not None and await write_behind_result_live(entry[0]):
+        return entry
+
+    # lookup_sql() only matches rows rendered with the default options.
+    if bg.RESULT_CACHE_DB_LOOKUP and options == bg.DEFAULT_RENDER_OPTIONS:
+        entry = await lookup_code_in_db(kind, value, render)
+        if entry is not None:
+            bg.result_cache.record_db_hit()
+            bg.result_cache.put(key, entry)
+            return entry
+
+    bg.result_cache.record_miss()
+    return None
+
+
+# v2 Endpoints
+
+def code_response(fmt, status_code, kind, unique_id, url, rendered, **extra):
+    if fmt == "json":
+        return jsonify(bg.code_json(kind, unique_id, url, rendered, **extra)), status_code
+    body, headers = bg.code_payload(fmt, kind, unique_id, url, rendered, **extra)
+    return Response(body, status=status_code, headers=headers)
+
+
+@app.after_request
+async def vary_on_accept(response):
+    if request.path in bg.NEGOTIATED_ROUTES:
+        response.vary.add("Accept")
+    return response
+
+
+async def generate_code(kind, symbology, value, data, render, options, bucket):
+    try:
+        fmt = bg.response_format(data, request.accept_mimetypes)
+    except ValueError as e:
+        return jsonify({"isSuccess": False, "message": str(e)}), 400
+    if fmt is None:
+        return jsonify(bg.not_acceptable_json()), 406
+
+    cache_options = tuple(sorted(options.items()))
+    render_args = (value, options) if options else (value,)
+
+    label = bg.V2_FIELDS[kind][3]
+    render_format = functools.partial(render, fmt=bg.image_format(fmt))
+    cached = await get_cached_code(symbology, kind, value, cache_options, render)
+    if cached:
+        unique_id, url, rendered = cached
+        if rendered.format != bg.image_format(fmt):
+            # Stored in another format: render the one asked for, for this response only.
+            try:
+                rendered = await run_render(render_format, *render_args)
+            except Exception as e:
+                print(f"Error generating {label}: {e}")
+                return jsonify({"isSuccess": False, "message": f"Failed to generate {label}"}), 500
+        return code_response(fmt, 201, kind, unique_id, url, rendered, cached=True)
+
+    unique_id = bg.generate_unique_id_new(value)
+    try:
+        rendered = await run_render(render_format, *render_args)
+    except DataOverflowError:
+        return jsonify({"isSuccess": False, "message": bg.qr_overflow_message(options)}), 400
+    except Exception as e:
+        print(f"Error generating {label}: {e}")
+        return jsonify({"isSuccess": False, "message": f"Failed to generate {label}"}), 500
+
+    if bg.wants_write_behind(data):
+        url = await asyncio.get_running_loop().run_in_executor(
+            None, bg.enqueue_write_behind, kind, value, unique_id, bucket, rendered, bg.render_options_text(options)
+        )
+        if url:
+            bg.result_cache.put((symbology, value, cache_options), (unique_id, url, rendered))
+            bg.image_cache.put((kind, unique_id), (unique_id, url, rendered))
+            return code_response(fmt, 202, kind, unique_id, url, rendered, **bg.pending_fields(unique_id))
+
+    url = await upload_to_supabase(rendered, unique_id, bucket)
+    if not url:
+        return jsonify({"isSuccess": False, "message": f"Failed to upload {label}"}), 500
+
+    if await store_code_in_db(kind, value, unique_id, url, rendered, bg.render_options_text(options)):
+        bg.result_cache.put((symbology, value, cache_options), (unique_id, url, rendered))
+        bg.image_cache.put((kind, unique_id), (unique_id, url, rendered))
+
+    return code_response(fmt, 201, kind, unique_id, url, rendered)
+
+
+@app.route('/generate_barcode_v2', methods=['POST'])
+async def generate_barcode_api_v2():
+    data = await request.get_json()
+    value = data.get("value")
+
+    if not value:
+        return jsonify({"isSuccess": False, "message": "Missing required field: text"}), 400
+
+    return await generate_code("barcode", "code128", value, data, bg.render_barcode, {}, bg.SUPABASE_BUCKET)
+
+
+@app.route('/generate_qrcode_v2', methods=['POST'])
+async def generate_qr_api_v2():
+    data = await request.get_json()
+    value = data.get("value")
+
+    if not value:
+        return jsonify({"isSuccess": False, "message": "Missing required field: text"}), 400
+
+    try:
+        options = bg.parse_qr_options(data)
+    except ValueError as e:
+        return jsonify({"isSuccess": False, "message": str(e)}), 400
+
+    return await generate_code("qr", "qr", value, data, bg.render_qr_code, options, bg.QR_SUPABASE_BUCKET)
+
+
+# Image Serving
+
+async def load_code_image(kind, unique_id):
+    """Async load_code_image(): the RenderedImage for unique_id, or None."""
+    entry = bg.image_cache.get((kind, unique_id))
+    if entry is not None and await write_behind_result_live(unique_id):
+        return entry[2]
+    bg.image_cache.record_miss()
+
+    try:
+        row = await fetch_row(bg.image_sql(kind), (unique_id,))
+    except Exception as e:
+        print(f"Database Error (image lookup): {e}")
+        return None
+
+    url = None
+    if row is None:
+        rendered = await asyncio.get_running_loop().run_in_executor(None, bg.load_pending_image, kind, unique_id)
+    else:
+        url, image = row
+        if image is not None:
+            rendered = bg.RenderedImage.from_stored(image, url)
+        else:
+            bucket = bg.SUPABASE_BUCKET if kind == "barcode" else bg.QR_SUPABASE_BUCKET
+            extension = url.rsplit(".", 1)[-1] if url else "jpg"
+            try:
+                data = await storage.download(bucket, f"static/{unique_id}.{extension}")
+            except Exception as e:
+                print(f"Error downloading from Supabase: {e}")
+                data = None
+            rendered = bg.RenderedImage.from_stored(data, url) if data else None
+    if rendered is not None:
+        bg.image_cache.put((kind, unique_id), (unique_id, url, rendered))
+    return rendered
+
+
+async def serve_code_image(kind, unique_id, label):
+    rendered = await load_code_image(kind, unique_id)
+    if rendered is None:
+        return jsonify({"isSuccess": False, "message": f"{label} not found"}), 404
+
+    response = Response(rendered.data, mimetype=rendered.content_type)
+    response.set_etag(rendered.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = bg.IMAGE_CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    return await response.make_conditional(request)
+
+
+@app.route('/barcode/<unique_id>', methods=['GET'])
+async def get_barcode_api(unique_id):
+    return await serve_code_image("barcode", unique_id, "Barcode")
+
+
+@app.route('/qrcode/<unique_id>', methods=['GET'])
+async def get_qr_api(unique_id):
+    return await serve_code_image("qr", unique_id, "QR Code")
+
+
+# Write-Behind Status, Stats and Metrics
+
+@app.before_serving
+async def resume_write_behind():
+    if os.path.exists(bg.WRITE_BEHIND_SPOOL):
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, bg.get_write_behind_spool)
+        except Exception as e:
+            print(f"Write-behind spool error: {e}")
+
+
+@app.route('/status/<unique_id>', methods=['GET'])
+async def write_behind_status_api(unique_id):
+    def status():
+        return bg.get_write_behind_spool().status(unique_id)
+    try:
+        status = await asyncio.get_running_loop().run_in_executor(None, status)
+    except Exception as e:
+        print(f"Write-behind spool error: {e}")
+        return jsonify({"isSuccess": False, "message": "Status unavailable"}), 503
+    if status is None:
+        return jsonify({"isSuccess": False, "message": "Unknown unique_id"}), 404
+    return jsonify({"isSuccess": True, "committed": status["state"] == "done", "status": status}), 200
+
+
+@app.route('/cache_stats', methods=['GET'])
+async def cache_stats_api():
+    return jsonify({"isSuccess": True, "cache": bg.result_cache.stats(), "image_cache": bg.image_cache.stats()}), 200
+
+
+@app.route('/db_stats', methods=['GET'])
+async def db_stats_api():
+    return jsonify({
+        "isSuccess": True,
+        "pool": db_pool.pool.get_stats(),
+        "group_commit": {
+            "barcode": {"batches": barcode_writer.batches, "rows": barcode_writer.rows},
+            "qr": {"batches": qr_writer.batches, "rows": qr_writer.rows},
+        },
+    }), 200
+
+
+@app.route('/startup_stats', methods=['GET'])
+async def startup_stats_api():
+    return jsonify({"isSuccess": True, "startup": bg.startup_report()}), 200
+
+
+def _endpoint_label():
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+@app.before_request
+async def start_request_metrics():
+    bg.record_first_request()
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+async def record_request_metrics(response):
+    started = getattr(g, "request_started", None)
+    if started is not None:
+        duration = time.perf_counter() - started
+        endpoint = _endpoint_label()
+        metrics.REQUEST_SECONDS.labels(request.method, endpoint).observe(duration)
+        metrics.REQUESTS.labels(request.method, endpoint, str(response.status_code)).inc()
+        if duration >= bg.SLOW_REQUEST_SECONDS:
+            metrics.SLOW_REQUESTS.labels(endpoint).inc()
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics_api():
+    body, content_type = metrics.exposition()
+    return Response(body, content_type=content_type)
@@ -1,16 +1,30 @@
+import time
+_import_started = time.monotonic()
+
 import os
 import threading
-import psycopg2
 import base64
-from psycopg2 import pool
-import barcode
-from barcode.writer import ImageWriter
-from flask import Flask, request, jsonify
-from supabase import create_client
+import hashlib
+import io
+import json
+import multiprocessing
+import random
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import psycopg2
+from psycopg2.extras import execute_values
+import code128
+from flask import Flask, Response, g, request, jsonify
+from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
-import qrcode
-import time
+import qr
+from spool import Spool
+from db import ConnectionPool, GroupCommitWriter
+import export
+import formats
+import metrics
 from PIL import Image
+from qrcode.exceptions import DataOverflowError
 
 load_dotenv()
 
@@ -26,7 +40,89 @@ DB_CONFIG = {
     "sslmode": "disable"
 }
 
-db_pool = pool.SimpleConnectionPool(1, 10, **DB_CONFIG)
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_GROUP_COMMIT_DELAY = float(os.getenv("DB_GROUP_COMMIT_DELAY", "0.005"))  # seconds a batch stays open
+
+# How generated images are kept in the DB:
+#   "base64"    - text column (*_image_base64), the original layout
+#   "bytea"     - binary column (*_image), a third smaller than base64
+#   "reference" - no image in the DB, only the storage URL
+# The binary columns and the unique_id index are added with:
+#   ALTER TABLE products_new ADD COLUMN IF NOT EXISTS barcode_image bytea;
+#   ALTER TABLE qr_codes_new ADD COLUMN IF NOT EXISTS qr_code_image bytea;
+#   CREATE UNIQUE INDEX IF NOT EXISTS products_new_unique_id_key ON products_new (unique_id);
+#   CREATE UNIQUE INDEX IF NOT EXISTS qr_codes_new_unique_id_key ON qr_codes_new (unique_id);
+# The index is unique so a retried write-behind INSERT (ON CONFLICT DO NOTHING)
+# cannot store a second row; the older products_new_unique_id_idx and
+# qr_codes_new_unique_id_idx can be dropped once it exists.
+IMAGE_STORAGE = os.getenv("IMAGE_STORAGE", "base64")
+if IMAGE_STORAGE not in ("base64", "bytea", "reference"):
+    raise ValueError(f"IMAGE_STORAGE must be base64, bytea or reference, not {IMAGE_STORAGE!r}")
+
+# kind: (table, URL column, base64 column, binary column)
+CODE_TABLES = {
+    "barcode": ("products_new", "barcode_image_path", "barcode_image_base64", "barcode_image"),
+    "qr": ("qr_codes_new", "qr_code_image_path", "qr_code_image_base64", "qr_code_image"),
+}
+# kind: column holding the non-default render options of a row (NULL for the
+# defaults), so only default renders satisfy a result cache lookup. Added with:
+#   ALTER TABLE qr_codes_new ADD COLUMN IF NOT EXISTS render_options text;
+OPTIONS_COLUMNS = {"qr": "render_options"}
+
+def insert_columns(kind):
+    """Returns (table, columns) written for kind under IMAGE_STORAGE."""
+    table, path_column, base64_column, binary_column = CODE_TABLES[kind]
+    columns = ["name", "unique_id", path_column]
+    if IMAGE_STORAGE == "base64":
+        columns.append(base64_column)
+    elif IMAGE_STORAGE == "bytea":
+        columns.append(binary_column)
+    if kind in OPTIONS_COLUMNS:
+        columns.append(OPTIONS_COLUMNS[kind])
+    return table, columns
+
+def insert_sql(kind):
+    table, columns = insert_columns(kind)
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s ON CONFLICT DO NOTHING"
+
+def image_column(kind):
+    """SQL expression selecting the stored image of kind (NULL in reference mode)."""
+    _, _, base64_column, binary_column = CODE_TABLES[kind]
+    return {"base64": base64_column, "bytea": binary_column}.get(IMAGE_STORAGE, "NULL")
+
+def lookup_sql(kind):
+    """Selects (unique_id, url, image) of the v2 row for a value; params (value, value)."""
+    table, path_column, _, _ = CODE_TABLES[kind]
+    # v1 rows store the batch name in `name` and encode the unique_id
+    # (name + timestamp) instead, so they must not satisfy a v2 lookup.
+    # Neither must rows rendered with non-default options.
+    defaults_only = f" AND {OPTIONS_COLUMNS[kind]} IS NULL" if kind in OPTIONS_COLUMNS else ""
+    return (f"SELECT unique_id, {path_column}, {image_column(kind)} FROM {table} "
+            f"WHERE name = %s AND left(unique_id, length(name)) <> %s{defaults_only} LIMIT 1")
+
+def image_sql(kind):
+    """Selects (url, image) of a row by unique_id; params (unique_id,)."""
+    table, path_column, _, _ = CODE_TABLES[kind]
+    return f"SELECT {path_column}, {image_column(kind)} FROM {table} WHERE unique_id = %s LIMIT 1"
+
+def render_options_text(options):
+    """The OPTIONS_COLUMNS value for options: compact JSON, or None for the defaults."""
+    return json.dumps(options, sort_keys=True, separators=(",", ":")) if options else None
+
+def image_row(kind, name, unique_id, url, rendered, render_options=None, binary=psycopg2.Binary):
+    """Row values matching insert_columns(kind); binary wraps bytea values for the driver.
+
+    render_options is the render_options_text() of a code with non-default options.
+    """
+    row = (name, unique_id, url)
+    if IMAGE_STORAGE == "base64":
+        row += (image_to_base64(rendered),)
+    elif IMAGE_STORAGE == "bytea":
+        row += (binary(rendered.data),)
+    if kind in OPTIONS_COLUMNS:
+        row += (render_options,)
+    return row
 
 # Supabase Configuration
 SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -34,138 +130,739 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 SUPABASE_BUCKET = "barcodes_new"
 QR_SUPABASE_BUCKET = "qrcodes_new"
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Batch generation (quantity-based endpoints)
+# Render processes per web worker (0 = render in-process). The default splits
+# the CPUs between the WEB_CONCURRENCY workers start.sh runs.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+BATCH_RENDER_WORKERS = int(os.getenv("BATCH_RENDER_WORKERS", max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)))
+BATCH_UPLOAD_CONCURRENCY = int(os.getenv("BATCH_UPLOAD_CONCURRENCY", "16"))
+BATCH_RENDER_TIMEOUT = float(os.getenv("BATCH_RENDER_TIMEOUT", "120"))  # seconds per batch in the render pool
+
+# Result cache (v2 endpoints)
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_DB_LOOKUP = os.getenv("RESULT_CACHE_DB_LOOKUP", "1") == "1"
+
+# Write-behind mode (v2 endpoints)
+WRITE_BEHIND_DEFAULT = os.getenv("WRITE_BEHIND_DEFAULT", "0") == "1"  # used when a request has no "async" field
+WRITE_BEHIND_SPOOL = os.getenv("WRITE_BEHIND_SPOOL", "/var/tmp/barcode_write_behind.sqlite3")
+WRITE_BEHIND_WORKERS = int(os.getenv("WRITE_BEHIND_WORKERS", "4"))
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "8"))
+WRITE_BEHIND_BACKOFF_BASE = float(os.getenv("WRITE_BEHIND_BACKOFF_BASE", "1"))
+WRITE_BEHIND_BACKOFF_MAX = float(os.getenv("WRITE_BEHIND_BACKOFF_MAX", "300"))
+
+# Bulk export (quantity runs with "export": "ndjson" | "zip" | "pdf")
+EXPORT_FORMATS = ("ndjson", "zip", "pdf")
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "100"))  # codes generated per step of a stream
+EXPORT_PAGE_SIZE = os.getenv("EXPORT_PAGE_SIZE", "A4")  # PDF label sheets: A4 or letter
+
+# Observability: slow requests are counted; PROFILE_SAMPLE_RATE of requests
+# are run under cProfile and kept in PROFILE_DIR when they turn out slow.
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "1.0"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # 0 = never profile, 1 = every request
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/var/tmp/barcode_profiles")
+
+# Image serving (GET /barcode/<id>, /qrcode/<id>)
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+IMAGE_CACHE_MAX_AGE = int(os.getenv("IMAGE_CACHE_MAX_AGE", str(365 * 24 * 3600)))  # images never change
+
+# Image format of new codes: png (1-bit), webp (lossless), svg, or jpeg (JPEG q80, as before)
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "png")
+if OUTPUT_FORMAT not in formats.FORMATS:
+    raise ValueError(f"OUTPUT_FORMAT must be one of {', '.join(formats.FORMATS)}, not {OUTPUT_FORMAT!r}")
+
+# Per-process clients
+#
+# Nothing network-facing is created at import. With gunicorn --preload the
+# module is imported once in the master and the workers are forked from it; a
+# socket opened before the fork would be shared by every worker. Each getter
+# creates its client on first use in the calling process (gunicorn.conf.py
+# does so right after a worker boots) and re-creates it if the process has
+# forked since.
+
+_clients = {}  # (name, pid) -> client
+_clients_lock = threading.RLock()
+
+def _per_process(name, factory):
+    # Keyed by pid, so clients inherited from a parent stay referenced and are
+    # never closed (or garbage collected) by the child: closing them would
+    # tear down the parent's connections too.
+    key = (name, os.getpid())
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = factory()
+    return client
+
+def _create_db_pool():
+    pool = ConnectionPool(DB_POOL_MIN, DB_POOL_MAX, in_use_gauge=metrics.DB_POOL_IN_USE, **DB_CONFIG)
+    metrics.DB_POOL_MAX.set(DB_POOL_MAX)
+    return pool
+
+def _create_supabase():
+    from supabase import create_client  # ~0.3s of imports, only paid by processes that upload
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+def get_db_pool():
+    return _per_process("db_pool", _create_db_pool)
+
+def get_supabase():
+    return _per_process("supabase", _create_supabase)
+
+def get_group_writer(kind):
+    return _per_process(
+        f"{kind}_writer",
+        lambda: GroupCommitWriter(get_db_pool(), insert_sql(kind), max_delay=DB_GROUP_COMMIT_DELAY)
+    )
+
+def open_clients():
+    """Creates this process's DB pool, writers and storage client up front."""
+    get_db_pool()
+    get_group_writer("barcode")
+    get_group_writer("qr")
+    get_supabase()
 
 def get_db_connection():
-    return db_pool.getconn()
+    return get_db_pool().getconn()
 
 def release_db_connection(conn):
-    db_pool.putconn(conn)
+    get_db_pool().putconn(conn)
+
+_unique_id_lock = threading.Lock()
+_last_unique_ms = 0
+
+def _next_unique_ms():
+    """Millisecond timestamp, bumped so no two calls in this process share one."""
+    global _last_unique_ms
+    with _unique_id_lock:
+        _last_unique_ms = max(int(time.time() * 1000), _last_unique_ms + 1)
+        return _last_unique_ms
+
+def _process_tag():
+    """Four random digits, drawn once per worker process.
+
+    Timestamps only keep ids unique within a process (and a batch bumps them
+    ahead of the clock); the tag keeps two workers generating ids for the same
+    name at the same time apart.
+    """
+    return _per_process("unique_id_tag", lambda: f"{random.SystemRandom().randrange(10 ** 4):04d}")
 
 def generate_unique_id(name):
-    return f"{name}{int(time.time() * 1000)}"  # Unique timestamp-based ID
+    return f"{name}{_next_unique_ms()}{_process_tag()}"  # Unique timestamp-based ID
+
+EXTENSION_CONTENT_TYPES = {"jpeg": "image/jpeg", **{extension: content_type for content_type, extension in formats.FORMATS.values()}}
+EXTENSION_FORMATS = {"jpeg": "jpeg", **{extension: fmt for fmt, (_, extension) in formats.FORMATS.items()}}
+
+def url_format(url):
+    """The output format of a stored image, from its URL's extension (None if unknown)."""
+    return EXTENSION_FORMATS.get(url.rsplit(".", 1)[-1].lower()) if url else None
+
+class RenderedImage:
+    """An encoded image held in memory.
+
+    Rendering produces exactly one of these per code; the upload, the DB insert
+    and the JSON response all read from it, so nothing touches the filesystem
+    and the image is only encoded once.
+    """
+
+    def __init__(self, data, content_type="image/jpeg", extension="jpg"):
+        self.data = data
+        self.content_type = content_type
+        self.extension = extension
+        self._base64 = None
+        self._etag = None
+
+    @classmethod
+    def encoded(cls, data, fmt):
+        return cls(data, *formats.FORMATS[fmt])
+
+    @classmethod
+    def from_base64(cls, image_base64, content_type="image/jpeg", extension="jpg"):
+        rendered = cls(base64.b64decode(image_base64), content_type, extension)
+        rendered._base64 = image_base64
+        return rendered
+
+    @classmethod
+    def from_stored(cls, image, url):
+        """Builds an image from a DB value (base64 text or bytea) or a download.
+
+        The type comes from the data itself: rows written before the output
+        formats existed hold JPEG under a .png URL. The URL's extension is only
+        the fallback.
+        """
+        if isinstance(image, str):
+            rendered = cls.from_base64(image)
+        else:
+            rendered = cls(bytes(image))
+        fmt = formats.sniff(rendered.data)
+        if fmt is not None:
+            rendered.content_type, rendered.extension = formats.FORMATS[fmt]
+        else:
+            rendered.extension = url.rsplit(".", 1)[-1].lower() if url else "jpg"
+            rendered.content_type = EXTENSION_CONTENT_TYPES.get(rendered.extension, "application/octet-stream")
+        return rendered
+
+    @property
+    def format(self):
+        """The output format name ("png", "svg", ...), or None if unknown."""
+        return EXTENSION_FORMATS.get(self.extension)
+
+    @property
+    def base64(self):
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.data).decode('utf-8')
+        return self._base64
+
+    @property
+    def etag(self):
+        if self._etag is None:
+            self._etag = hashlib.sha256(self.data).hexdigest()
+        return self._etag
+
+
+@metrics.timed("render_barcode")
+def render_barcode(value, fmt=None):
+    """Renders and encodes a Code-128 barcode for value in fmt (default OUTPUT_FORMAT); raises on failure."""
+    fmt = fmt or OUTPUT_FORMAT
+    if fmt == "svg":
+        return RenderedImage.encoded(code128.svg(value), fmt)
+    image = code128.render(value)
+
+    rendered = encode_image(image, fmt)
+    if not rendered:
+        raise ValueError("Barcode image could not be encoded")
+    return rendered
+
+def parse_qr_options(data):
+    """Reads the optional QR render options from a request body.
+
+    Returns a dict of the options that differ from qrcode.make()'s defaults;
+    raises ValueError when one is invalid.
+    """
+    def integer(value):
+        return isinstance(value, int) and not isinstance(value, bool)  # JSON true is not 1
+
+    options = {}
+    version = data.get("version")
+    if version is not None:
+        if not integer(version) or not 1 <= version <= 40:
+            raise ValueError("version must be an integer from 1 to 40")
+        options["version"] = version
+    error_correction = data.get("error_correction")
+    if error_correction is not None:
+        if not isinstance(error_correction, str) or error_correction not in qr.ERROR_CORRECTION:
+            raise ValueError("error_correction must be one of L, M, Q, H")
+        options["error_correction"] = error_correction
+    box_size = data.get("box_size")
+    if box_size is not None:
+        if not integer(box_size) or not 1 <= box_size <= 50:
+            raise ValueError("box_size must be an integer from 1 to 50")
+        options["box_size"] = box_size
+    border = data.get("border")
+    if border is not None:
+        if not integer(border) or not 0 <= border <= 20:
+            raise ValueError("border must be an integer from 0 to 20")
+        options["border"] = border
+
+    defaults = {"error_correction": qr.ERROR_CORRECTION_DEFAULT, "box_size": qr.BOX_SIZE, "border": qr.BORDER}
+    return {key: value for key, value in options.items() if defaults.get(key) != value}
+
+def qr_overflow_message(options):
+    if "version" in options:
+        return f"value does not fit in a version {options['version']} QR Code"
+    return "value is too long for a QR Code"
+
+@metrics.timed("render_qr")
+def render_qr_code(value, options=None, fmt=None):
+    """Renders and encodes a QR code for value in fmt (default OUTPUT_FORMAT); raises on failure."""
+    fmt = fmt or OUTPUT_FORMAT
+    if fmt == "svg":
+        return RenderedImage.encoded(qr.svg(value, **(options or {})), fmt)
+    image = qr.render(value, **(options or {}))
+
+    rendered = encode_image(image, fmt)
+    if not rendered:
+        raise ValueError("QR Code image could not be encoded")
+    return rendered
+
 
 def generate_barcode(name):
-    """Generates a Code-128 barcode and saves it to /tmp."""
+    """Generates a Code-128 barcode in memory."""
     try:
         unique_id = generate_unique_id(name)
-        save_dir = "/tmp"
-        os.makedirs(save_dir, exist_ok=True)  # Ensure /tmp directory exists
-
-        barcode_path = f"{save_dir}/{unique_id}"
-        code128 = barcode.get_barcode_class('code128')
-        barcode_instance = code128(unique_id, writer=ImageWriter())
-        full_path = barcode_instance.save(barcode_path)  # Save returns actual file path
-
-        if not os.path.exists(full_path):
-            raise FileNotFoundError(f"Barcode image was not created: {full_path}")
-
-        return full_path, unique_id
+        return render_barcode(unique_id), unique_id
     except Exception as e:
         print(f"Error generating barcode: {e}")
         return None, None
 
 def generate_qr_code(name):
-    """Generates a QR code and saves it to /tmp."""
+    """Generates a QR code in memory."""
     try:
         unique_id = generate_unique_id(name)
-        qr_path = f"/tmp/{unique_id}.png"
-        qr = qrcode.make(unique_id)
-        qr.save(qr_path)
-        return qr_path, unique_id
+        return render_qr_code(unique_id), unique_id
     except Exception as e:
         print(f"Error generating QR Code: {e}")
         return None, None
 
 
-def convert_to_jpeg(image_path):
-    """Converts PNG image to a smaller JPEG."""
+@metrics.timed("encode")
+def encode_image(image, fmt=None):
+    """Encodes a PIL image in a raster format (default OUTPUT_FORMAT) in memory."""
+    fmt = fmt or OUTPUT_FORMAT
     try:
-        image = Image.open(image_path)
-        jpeg_path = image_path.replace(".png", ".jpg")
-        image = image.convert("RGB")  # Convert PNG with alpha to RGB
-        image.save(jpeg_path, "JPEG", quality=80)  # Save with compression
-        return jpeg_path
+        return RenderedImage.encoded(formats.encode(image, fmt), fmt)
     except Exception as e:
-        print(f"Error converting to JPEG: {e}")
+        print(f"Error encoding image as {fmt}: {e}")
         return None
 
 
-def image_to_base64(image_path):
-    """Converts an image file to a Base64 string."""
+@metrics.timed("base64")
+def image_to_base64(rendered):
+    """Returns the Base64 string of a rendered image (encoded at most once)."""
     try:
-        jpeg_path = convert_to_jpeg(image_path)  # Resize and convert image to JPEG
-        if not jpeg_path:
-            return None
-        with open(jpeg_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        return rendered.base64
     except Exception as e:
         print(f"Error converting image to base64: {e}")
         return None
     
 
-def upload_to_supabase(image_path, unique_id, bucket):
-    try:
-        if not os.path.exists(image_path):
-            print(f"Error: File not found before upload: {image_path}")
-            return None
+def public_url(unique_id, bucket, extension):
+    return f"{SUPABASE_URL}/storage/v1/object/public/{bucket}/static/{unique_id}.{extension}"
+
 
-        print(f"Uploading file: {image_path}")  # Debugging log
+@metrics.timed("upload")
+def upload_to_supabase(rendered, unique_id, bucket, upsert=False):
+    try:
+        file_options = {"content-type": rendered.content_type}
+        if upsert:
+            file_options["upsert"] = "true"  # retries may find their own earlier upload
+        with metrics.UPLOADS_IN_FLIGHT.track_inprogress():
+            get_supabase().storage.from_(bucket).upload(f"static/{unique_id}.{rendered.extension}", rendered.data, file_options)
 
-        with open(image_path, "rb") as f:
-            supabase.storage.from_(bucket).upload(f"static/{unique_id}.png", f, {"content-type": "image/png"})
-        
-        return f"{SUPABASE_URL}/storage/v1/object/public/{bucket}/static/{unique_id}.png"
+        return public_url(unique_id, bucket, rendered.extension)
     except Exception as e:
         print(f"Error uploading to Supabase: {e}")
         return None
 
 
 
-def store_barcode_in_db(name, unique_id, barcode_url, barcode_path):
+@metrics.timed("store_barcode")
+def store_barcode_in_db(name, unique_id, barcode_url, rendered):
+    # Joins concurrent requests' rows into one INSERT + commit.
     try:
-        barcode_base64 = image_to_base64(barcode_path)
-        if not barcode_base64:
-            return False
-
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO products_new (name, unique_id, barcode_image_path, barcode_image_base64) VALUES (%s, %s, %s, %s)",
-            (name, unique_id, barcode_url, barcode_base64)
-        )
-        conn.commit()
-        cur.close()
-        release_db_connection(conn)
-        return True
-    except Exception as e:
+        writer = get_group_writer("barcode")
+    except Exception as e:  # the pool connects on creation: DB unreachable
         print(f"Database Error (Barcode): {e}")
         return False
+    return writer.write(image_row("barcode", name, unique_id, barcode_url, rendered))
 
 
-def store_qr_in_db(name, unique_id, qr_url, qr_path):
+@metrics.timed("store_qr")
+def store_qr_in_db(name, unique_id, qr_url, rendered, render_options=None):
     try:
-        qr_base64 = image_to_base64(qr_path)
-        if not qr_base64:
-            return False
-
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO qr_codes_new (name, unique_id, qr_code_image_path, qr_code_image_base64) VALUES (%s, %s, %s, %s)",
-            (name, unique_id, qr_url, qr_base64)
-        )
-        conn.commit()
-        cur.close()
-        release_db_connection(conn)
-        return True
+        writer = get_group_writer("qr")
     except Exception as e:
         print(f"Database Error (QR Code): {e}")
-        if conn:
-            conn.rollback()  # 🚀 Ensure transaction rollback
+        return False
+    return writer.write(image_row("qr", name, unique_id, qr_url, rendered, render_options))
+
+
+@app.route('/db_stats', methods=['GET'])
+def db_stats_api():
+    return jsonify({
+        "isSuccess": True,
+        "pool": get_db_pool().stats(),
+        "group_commit": {
+            kind: {"batches": writer.batches, "rows": writer.rows}
+            for kind, writer in (("barcode", get_group_writer("barcode")), ("qr", get_group_writer("qr")))
+        },
+    }), 200
+
+
+# Startup
+#
+# start.sh runs gunicorn with --preload: this module is imported, and
+# warm_up() run, once in the master (see gunicorn.conf.py), so every forked
+# worker starts with the code, font, QR tables and PIL codecs already loaded
+# and shares those pages copy-on-write. Workers then only open their own
+# clients. Each one prints a startup line at its first request; GET
+# /startup_stats returns the same figures for the worker that serves it.
+
+_startup = {
+    "pid": os.getpid(),  # process the figures below belong to
+    "preloaded": False,  # imported (and warmed) by a parent before forking
+    "started": _import_started,
+    "import_seconds": None,
+    "warm_up_seconds": None,
+    "clients_seconds": None,
+    "first_request_seconds": None,
+}
+_startup_lock = threading.Lock()
+
+def _process_startup():
+    if _startup["pid"] != os.getpid():
+        # First call since a fork: import and warm-up were paid by the parent.
+        _startup.update(pid=os.getpid(), preloaded=True, started=time.monotonic(),
+                        clients_seconds=None, first_request_seconds=None)
+    return _startup
+
+def warm_up():
+    """Loads what the first requests would: the storage client's package, PIL's codecs,
+    the barcode font and QR tables.
+
+    Opens no DB or storage connections, so it is safe before forking.
+    """
+    started = time.monotonic()
+    import supabase  # the package only; each worker creates its own client
+    Image.init()
+    qr.warm_up()
+    for image in (code128.render("WARMUP-0123456789"), qr.render("warm-up")):
+        for fmt in formats.RASTER_FORMATS:
+            encode_image.__wrapped__(image, fmt)  # unwrapped: not recorded as a request stage
+    _startup["warm_up_seconds"] = time.monotonic() - started
+    print(f"Warm-up done in {_startup['warm_up_seconds']:.3f}s")
+
+def worker_started():
+    """Starts this worker's startup clock (gunicorn post_fork hook)."""
+    _process_startup()
+
+def clients_opened(started):
+    """Records the time since started (time.monotonic()) as this process's client setup time."""
+    seconds = _process_startup()["clients_seconds"] = time.monotonic() - started
+    metrics.WORKER_STARTUP_SECONDS.labels("clients").set(seconds)
+
+def open_worker_clients():
+    """Opens this worker's clients before it takes requests (gunicorn post_worker_init hook)."""
+    started = time.monotonic()
+    try:
+        open_clients()
+    except Exception as e:
+        print(f"Error opening clients (retried on first use): {e}")
+        return
+    clients_opened(started)
+
+def startup_report():
+    state = _process_startup()
+    memory = metrics.process_memory()
+    for kind, value in memory.items():
+        metrics.WORKER_MEMORY_BYTES.labels(kind).set(value)
+    return {
+        "pid": state["pid"],
+        "preloaded": state["preloaded"],
+        "import_seconds": state["import_seconds"],
+        "warm_up_seconds": state["warm_up_seconds"],
+        "clients_seconds": state["clients_seconds"],
+        "first_request_seconds": state["first_request_seconds"],
+        "uptime_seconds": time.monotonic() - state["started"],
+        "memory_bytes": memory,
+    }
+
+
+@app.before_request
+def record_first_request():
+    state = _process_startup()
+    if state["first_request_seconds"] is not None:
+        return
+    with _startup_lock:
+        if state["first_request_seconds"] is not None:
+            return
+        state["first_request_seconds"] = time.monotonic() - state["started"]
+    metrics.WORKER_STARTUP_SECONDS.labels("first_request").set(state["first_request_seconds"])
+    report = startup_report()
+    seconds = lambda key: "-" if report[key] is None else f"{report[key]:.3f}s"
+    memory = ", ".join(f"{kind} {value / 2 ** 20:.1f} MiB" for kind, value in report["memory_bytes"].items())
+    print(
+        f"Startup (pid {report['pid']}{', preloaded' if report['preloaded'] else ''}): "
+        f"import {seconds('import_seconds')}, warm-up {seconds('warm_up_seconds')}, "
+        f"clients {seconds('clients_seconds')}, first request after {seconds('first_request_seconds')}; {memory}"
+    )
+
+
+@app.route('/startup_stats', methods=['GET'])
+def startup_stats_api():
+    return jsonify({"isSuccess": True, "startup": startup_report()}), 200
+
+
+# Request Metrics
+#
+# Every request is timed and counted by route template (so /status/<id> is one
+# series); stage timings come from the @metrics.timed helpers above.
+
+request_profiler = metrics.SlowRequestProfiler(PROFILE_DIR, PROFILE_SAMPLE_RATE, SLOW_REQUEST_SECONDS)
+
+def _endpoint_label():
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.request_profile = request_profiler.start()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get("request_started")
+    if started is not None:
+        duration = time.perf_counter() - started
+        endpoint = _endpoint_label()
+        metrics.REQUEST_SECONDS.labels(request.method, endpoint).observe(duration)
+        metrics.REQUESTS.labels(request.method, endpoint, str(response.status_code)).inc()
+        if duration >= SLOW_REQUEST_SECONDS:
+            metrics.SLOW_REQUESTS.labels(endpoint).inc()
+    return response
+
+
+@app.teardown_request
+def stop_request_profile(exc):
+    # Runs even when the view raised, so the profiler is always released.
+    profile = g.pop("request_profile", None)
+    if profile is not None:
+        request_profiler.stop(profile, time.perf_counter() - g.request_started, _endpoint_label())
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_api():
+    body, content_type = metrics.exposition()
+    return Response(body, content_type=content_type)
+
+
+
+# Batch Generation Engine
+#
+# Renders run across a process pool (CPU bound), uploads through a bounded
+# thread pool (network bound) as soon as each render finishes, and all rows of
+# a batch are written with a single multi-row INSERT. Failures are recorded per
+# item so one bad upload does not abort the rest of the batch.
+
+_render_pool = None
+_upload_pool = None
+_batch_pools_lock = threading.Lock()
+
+def get_render_pool():
+    global _render_pool
+    if BATCH_RENDER_WORKERS <= 0:
+        return None
+    with _batch_pools_lock:
+        if _render_pool is None:
+            # Not fork: this process runs upload, group-commit and write-behind
+            # threads, and a child forked while one of them holds a lock (the
+            # metrics value lock, say) deadlocks on its first render. The fork
+            # server imports the app once, and every render process it forks
+            # shares those pages instead of importing it again.
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context("spawn")
+            _render_pool = ProcessPoolExecutor(max_workers=BATCH_RENDER_WORKERS, mp_context=context)
+        return _render_pool
+
+def drop_render_pool(render_pool):
+    """Stops using a broken or stuck render pool; the next batch starts a new one."""
+    global _render_pool
+    with _batch_pools_lock:
+        if _render_pool is render_pool:
+            _render_pool = None
+    # Not cancel_futures: other requests' renders are queued on this pool
+    # too. They finish there, or fail or time out and fall back on their own.
+    render_pool.shutdown(wait=False)
+
+def get_upload_pool():
+    global _upload_pool
+    with _batch_pools_lock:
+        if _upload_pool is None:
+            _upload_pool = ThreadPoolExecutor(max_workers=BATCH_UPLOAD_CONCURRENCY, thread_name_prefix="upload")
+        return _upload_pool
+
+
+def _render_batch_item(job):
+    """Process-pool entry point: returns (unique_id, rendered, error)."""
+    render, unique_id = job
+    try:
+        return unique_id, render(unique_id), None
+    except Exception as e:
+        return unique_id, None, f"Failed to render: {e}"
+
+
+def _render_batch(render, unique_ids):
+    """Yields (unique_id, rendered, error) in order, as renders complete."""
+    jobs = [(render, unique_id) for unique_id in unique_ids]
+    done = 0
+    render_pool = get_render_pool()
+    if render_pool is not None:
+        try:
+            chunksize = max(1, len(jobs) // (BATCH_RENDER_WORKERS * 4))
+            results = render_pool.map(_render_batch_item, jobs, chunksize=chunksize, timeout=BATCH_RENDER_TIMEOUT)
+            for result in results:
+                yield result
+                done += 1
+            return
+        except Exception as e:
+            # A broken or stuck pool must not fail (or hang) the request;
+            # finish rendering here.
+            print(f"Render pool unavailable, rendering in-process: {e!r}")
+            drop_render_pool(render_pool)
+    for job in jobs[done:]:
+        yield _render_batch_item(job)
+
+
+def _upload_batch_item(unique_id, rendered, bucket):
+    url = upload_to_supabase(rendered, unique_id, bucket)
+    if not url:
+        return unique_id, rendered, None, "Failed to upload"
+    return unique_id, rendered, url, None
+
+
+@metrics.timed("store_qr_batch")
+def store_qr_batch_in_db(items):
+    """Inserts (name, unique_id, qr_url, rendered) rows in one multi-row INSERT."""
+    if not items:
+        return True
+    try:
+        with get_db_pool().connection() as conn:
+            with conn.cursor() as cur:
+                execute_values(
+                    cur,
+                    insert_sql("qr"),
+                    [image_row("qr", name, unique_id, qr_url, rendered) for name, unique_id, qr_url, rendered in items],
+                    page_size=len(items)
+                )
+            conn.commit()
+        return True
+    except Exception as e:
+        print(f"Database Error (QR Code batch): {e}")
         return False
 
 
+def _generate_chunk(name, unique_ids, render, bucket, store_batch):
+    """Renders, uploads and stores unique_ids.
+
+    Returns (unique_id, rendered, url, error) for each, in unique_id order.
+    """
+    upload_pool = get_upload_pool()
+    results = {}
+
+    uploads = []
+    for unique_id, rendered, error in _render_batch(render, unique_ids):
+        if error:
+            results[unique_id] = (unique_id, None, None, error)
+            continue
+        uploads.append(upload_pool.submit(_upload_batch_item, unique_id, rendered, bucket))
+
+    uploaded = []
+    for future in uploads:
+        unique_id, rendered, url, error = future.result()
+        if error:
+            results[unique_id] = (unique_id, rendered, None, error)
+        else:
+            uploaded.append((unique_id, rendered, url))
+
+    stored = not store_batch or store_batch([(name, unique_id, url, rendered) for unique_id, rendered, url in uploaded])
+    for unique_id, rendered, url in uploaded:
+        results[unique_id] = (unique_id, rendered, url, None) if stored else (unique_id, rendered, None, "Failed to store in database")
+    return [results[unique_id] for unique_id in unique_ids]
+
+
+def stream_batch(name, quantity, render, bucket, store_batch=None, chunk_size=None):
+    """Yields (unique_id, rendered, url, error) for quantity codes, in order.
+
+    Codes are generated chunk_size at a time, so memory is bounded by one
+    chunk and the first results are available before the last are rendered.
+    """
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    for start in range(0, quantity, chunk_size):
+        unique_ids = [generate_unique_id(name) for _ in range(min(chunk_size, quantity - start))]
+        yield from _generate_chunk(name, unique_ids, render, bucket, store_batch)
+
+
+def generate_batch(name, quantity, render, bucket, store_batch=None):
+    """Generates quantity codes for name.
+
+    Returns (succeeded, failed): lists of (unique_id, url) and
+    (unique_id, error), each in unique_id order.
+    """
+    succeeded = []
+    failed = []
+    for unique_id, _, url, error in stream_batch(name, quantity, render, bucket, store_batch, chunk_size=quantity):
+        if error:
+            failed.append((unique_id, error))
+        else:
+            succeeded.append((unique_id, url))
+    return succeeded, failed
+
+
+def batch_result(succeeded, failed, key, url_key, label):
+    """Returns (body, status) for a quantity run, reporting per-item failures."""
+    items = [{"unique_id": unique_id, url_key: url} for unique_id, url in succeeded]
+    errors = [{"unique_id": unique_id, "error": error} for unique_id, error in failed]
+
+    if not failed:
+        return {"isSuccess": True, "message": f"{label} generated", key: items}, 201
+    if not succeeded:
+        return {"isSuccess": False, "message": f"Failed to generate {label}", key: items, "failed": errors}, 500
+    return {"isSuccess": True, "message": f"{label} partially generated", key: items, "failed": errors}, 207
+
+
+def batch_response(succeeded, failed, key, url_key, label):
+    body, status = batch_result(succeeded, failed, key, url_key, label)
+    return jsonify(body), status
+
+
+def export_body(name, quantity, render, bucket, store_batch, export_format, url_key, label):
+    """Streams a quantity run as NDJSON, a ZIP of images or a PDF label sheet.
+
+    Returns (body iterator, mimetype, download filename or None). The status
+    line is sent before the first code is rendered, so per-item failures are
+    reported in the body: as error records in NDJSON, in failures.ndjson
+    inside the ZIP, and by omission (and a log line) in the PDF.
+    """
+    items = stream_batch(name, quantity, render, bucket, store_batch)
+    filename = secure_filename(name) or "codes"
+
+    if export_format == "ndjson":
+        body = export.ndjson(
+            {"unique_id": unique_id, "error": error} if error else {"unique_id": unique_id, url_key: url}
+            for unique_id, _, url, error in items
+        )
+        return body, "application/x-ndjson", None
+
+    if export_format == "zip":
+        def files():
+            failures = []
+            for unique_id, rendered, _, error in items:
+                if error:
+                    failures.append({"unique_id": unique_id, "error": error})
+                else:
+                    yield f"{unique_id}.{rendered.extension}", rendered.data
+            if failures:
+                yield "failures.ndjson", "".join(export.ndjson(failures)).encode("utf-8")
+        return export.zip_archive(files()), "application/zip", f"{filename}-{label}.zip"
+
+    def labels():
+        for unique_id, rendered, _, error in items:
+            if error:
+                print(f"Export: skipping {unique_id}: {error}")
+                continue
+            if rendered.format == "svg":
+                rendered = render(unique_id, fmt="png")  # the sheet is a raster image
+            yield Image.open(io.BytesIO(rendered.data))
+    page_size = export.PAGE_SIZES.get(EXPORT_PAGE_SIZE, export.PAGE_SIZES["A4"])
+    return export.pdf_sheets(labels(), page_size), "application/pdf", f"{filename}-{label}.pdf"
+
+
+def export_headers(filename):
+    headers = {"X-Accel-Buffering": "no"}  # let proxies pass chunks through as they are produced
+    if filename:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return headers
+
+
+def export_response(name, quantity, render, bucket, store_batch, export_format, url_key, label):
+    body, mimetype, filename = export_body(name, quantity, render, bucket, store_batch, export_format, url_key, label)
+    return Response(body, mimetype=mimetype, headers=export_headers(filename))
+
 
 @app.route('/generate_barcode', methods=['POST'])
 def generate_barcode_api():
@@ -175,20 +872,17 @@ def generate_barcode_api():
 
     if not name or not quantity:
         return jsonify({"isSuccess": False, "message": "Missing required fields"}), 400
+    if not isinstance(quantity, int) or quantity < 1:
+        return jsonify({"isSuccess": False, "message": "quantity must be a positive integer"}), 400
 
-    barcode_urls = []
-    for _ in range(quantity):
-        barcode_path, unique_id = generate_barcode(name)
-        if not barcode_path:
-            return jsonify({"isSuccess": False, "message": "Failed to generate barcode"}), 500
-
-        barcode_url = upload_to_supabase(barcode_path, unique_id, SUPABASE_BUCKET)
-        if not barcode_url:
-            return jsonify({"isSuccess": False, "message": "Failed to upload barcode"}), 500
+    export_format = data.get("export")
+    if export_format:
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({"isSuccess": False, "message": f"export must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+        return export_response(name, quantity, render_barcode, SUPABASE_BUCKET, None, export_format, "barcode_image_path", "barcodes")
 
-        barcode_urls.append({"unique_id": unique_id, "barcode_image_path": barcode_url})
-
-    return jsonify({"isSuccess": True, "message": "Barcodes generated", "barcodes": barcode_urls}), 201
+    succeeded, failed = generate_batch(name, quantity, render_barcode, SUPABASE_BUCKET)
+    return batch_response(succeeded, failed, "barcodes", "barcode_image_path", "Barcodes")
 
 @app.route('/generate_qrcode', methods=['POST'])
 def generate_qr_api():
@@ -198,50 +892,30 @@ def generate_qr_api():
 
     if not name or not quantity:
         return jsonify({"isSuccess": False, "message": "Missing required fields"}), 400
+    if not isinstance(quantity, int) or quantity < 1:
+        return jsonify({"isSuccess": False, "message": "quantity must be a positive integer"}), 400
 
-    qr_urls = []
-    for _ in range(quantity):
-        qr_path, unique_id = generate_qr_code(name)
-        if not qr_path:
-            return jsonify({"isSuccess": False, "message": "Failed to generate QR Code"}), 500
-
-        qr_url = upload_to_supabase(qr_path, unique_id, QR_SUPABASE_BUCKET)
-        if not qr_url:
-            return jsonify({"isSuccess": False, "message": "Failed to upload QR Code"}), 500
-
-        if not store_qr_in_db(name, unique_id, qr_url):
-            return jsonify({"isSuccess": False, "message": "Failed to store QR Code in database"}), 500
+    export_format = data.get("export")
+    if export_format:
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({"isSuccess": False, "message": f"export must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+        return export_response(name, quantity, render_qr_code, QR_SUPABASE_BUCKET, store_qr_batch_in_db, export_format, "qr_code_image_path", "qr_codes")
 
-        qr_urls.append({"unique_id": unique_id, "qr_code_image_path": qr_url})
-
-    return jsonify({"isSuccess": True, "message": "QR Codes generated", "qr_codes": qr_urls}), 201
+    succeeded, failed = generate_batch(name, quantity, render_qr_code, QR_SUPABASE_BUCKET, store_qr_batch_in_db)
+    return batch_response(succeeded, failed, "qr_codes", "qr_code_image_path", "QR Codes")
 
 #-------------------------------------------------------------------------------------------------------------------
 
 def generate_unique_id_new(data):
-    return f"{abs(hash(data))}{int(time.time() * 1000)}"  # Ensure hash value is positive
+    return f"{abs(hash(data))}{_next_unique_ms()}{_process_tag()}"  # Ensure hash value is positive
 
 # Barcode Generation
 
-def generate_barcode_new(data):
+@metrics.timed("generate_barcode")
+def generate_barcode_new(data, fmt=None):
     try:
         unique_id = generate_unique_id_new(data)
-        save_dir = "/tmp"
-        os.makedirs(save_dir, exist_ok=True)
-
-        barcode_path = f"{save_dir}/{unique_id}.png"  # Save as PNG first
-        code128 = barcode.get_barcode_class('code128')
-        barcode_instance = code128(data, writer=ImageWriter())
-        full_path = barcode_instance.save(barcode_path)  # Now the file exists
-
-        if not os.path.exists(full_path):
-            raise FileNotFoundError(f"Barcode image was not created: {full_path}")
-
-        # Convert to JPEG AFTER the barcode is generated
-        jpeg_path = convert_to_jpeg(full_path)
-        if jpeg_path:
-            return jpeg_path, unique_id
-        return full_path, unique_id  # Return PNG if JPEG conversion fails
+        return render_barcode(data, fmt), unique_id
     except Exception as e:
         print(f"Error generating barcode: {e}")
         return None, None
@@ -270,21 +944,13 @@ def generate_barcode_new(data):
 
 
 # QR Code Generation
-def generate_qr_code_new(data):
+@metrics.timed("generate_qr")
+def generate_qr_code_new(data, options=None, fmt=None):
     try:
         unique_id = generate_unique_id_new(data)
-        save_dir = "/tmp"
-        os.makedirs(save_dir, exist_ok=True)
-
-        qr_path = f"{save_dir}/{unique_id}.png"  # Save as PNG first
-        qr = qrcode.make(data)
-        qr.save(qr_path)
-
-        # Convert to JPEG AFTER the QR code is generated
-        jpeg_path = convert_to_jpeg(qr_path)
-        if jpeg_path:
-            return jpeg_path, unique_id
-        return qr_path, unique_id  # Return PNG if JPEG conversion fails
+        return render_qr_code(data, options, fmt), unique_id
+    except DataOverflowError:
+        raise  # the client's value and options: a 400, not a failure
     except Exception as e:
         print(f"Error generating QR Code: {e}")
         return None, None
@@ -303,6 +969,530 @@ def generate_qr_code_new(data):
 #         print(f"Error generating QR Code: {e}")
 #         return None, None
 
+# Result Cache
+#
+# The v2 endpoints see many duplicate requests (POS retries and re-prints), so
+# results are cached on (symbology, value, render options) in two tiers:
+#   1. an in-process LRU of (unique_id, url, RenderedImage), bounded by the
+#      total size of the encoded images;
+#   2. a lookup of the existing row in products_new / qr_codes_new.
+# A hit on either tier skips rendering, upload and INSERT. Tier two expects an
+# index on the name column of both tables:
+#   CREATE INDEX IF NOT EXISTS products_new_name_idx ON products_new (name);
+#   CREATE INDEX IF NOT EXISTS qr_codes_new_name_idx ON qr_codes_new (name);
+
+DEFAULT_RENDER_OPTIONS = ()
+
+class ResultCache:
+    """Thread-safe LRU of generated codes, bounded by encoded image bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        size = len(entry[2].data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[2].data)
+            self._entries[key] = entry
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted[2].data)
+
+    def discard(self, unique_id):
+        """Drops every entry for unique_id."""
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[0] == unique_id]:
+                self._size -= len(self._entries.pop(key)[2].data)
+
+    def record_db_hit(self):
+        with self._lock:
+            self.db_hits += 1
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+result_cache = ResultCache(RESULT_CACHE_MAX_BYTES)
+
+
+def _lookup_code_in_db(kind, value, render):
+    try:
+        with get_db_pool().connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(lookup_sql(kind), (value, value))
+                row = cur.fetchone()
+            conn.commit()
+        if not row:
+            return None
+        unique_id, url, image = row
+        if image is None:
+            # Nothing stored in the DB (reference mode): re-rendering the same
+            # value (in the uploaded file's format) is cheap and still skips
+            # the upload and INSERT.
+            return unique_id, url, render(value, fmt=url_format(url))
+        return unique_id, url, RenderedImage.from_stored(image, url)
+    except Exception as e:
+        print(f"Database Error (cache lookup): {e}")
+        return None
+
+
+def lookup_barcode_in_db(value):
+    return _lookup_code_in_db("barcode", value, render_barcode)
+
+
+def lookup_qr_in_db(value):
+    return _lookup_code_in_db("qr", value, render_qr_code)
+
+
+def get_cached_code(symbology, value, options, db_lookup):
+    """Returns (unique_id, url, rendered) from either cache tier, or None."""
+    key = (symbology, value, options)
+    entry = result_cache.get(key)
+    if entry is not None and write_behind_result_live(entry[0]):
+        return entry
+
+    # lookup_sql() only matches rows rendered with the default options.
+    if RESULT_CACHE_DB_LOOKUP and options == DEFAULT_RENDER_OPTIONS:
+        entry = db_lookup(value)
+        if entry is not None:
+            result_cache.record_db_hit()
+            result_cache.put(key, entry)
+            return entry
+
+    result_cache.record_miss()
+    return None
+
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats_api():
+    return jsonify({"isSuccess": True, "cache": result_cache.stats(), "image_cache": image_cache.stats()}), 200
+
+# Image Serving
+#
+# GET /barcode/<unique_id> and /qrcode/<unique_id> return the raw image with a
+# strong ETag (SHA-256 of the bytes) and a long-lived immutable Cache-Control,
+# so clients and CDNs can revalidate or cache instead of re-generating.
+# Recently generated or served images are kept in an in-process LRU.
+
+image_cache = ResultCache(IMAGE_CACHE_MAX_BYTES)
+
+def download_from_supabase(bucket, unique_id, extension):
+    try:
+        return get_supabase().storage.from_(bucket).download(f"static/{unique_id}.{extension}")
+    except Exception as e:
+        print(f"Error downloading from Supabase: {e}")
+        return None
+
+
+def load_code_image(kind, unique_id):
+    """Returns the RenderedImage for unique_id, or None if there is none."""
+    entry = image_cache.get((kind, unique_id))
+    if entry is not None and write_behind_result_live(unique_id):
+        return entry[2]
+    image_cache.record_miss()
+
+    try:
+        with get_db_pool().connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(image_sql(kind), (unique_id,))
+                row = cur.fetchone()
+            conn.commit()
+    except Exception as e:
+        print(f"Database Error (image lookup): {e}")
+        return None
+
+    if row is None:
+        rendered = load_pending_image(kind, unique_id)
+        url = None
+    else:
+        url, image = row
+        if image is not None:
+            rendered = RenderedImage.from_stored(image, url)
+        else:
+            bucket = SUPABASE_BUCKET if kind == "barcode" else QR_SUPABASE_BUCKET
+            extension = url.rsplit(".", 1)[-1] if url else "jpg"
+            data = download_from_supabase(bucket, unique_id, extension)
+            rendered = RenderedImage.from_stored(data, url) if data else None
+    if rendered is not None:
+        image_cache.put((kind, unique_id), (unique_id, url, rendered))
+    return rendered
+
+
+def serve_code_image(kind, unique_id, label):
+    rendered = load_code_image(kind, unique_id)
+    if rendered is None:
+        return jsonify({"isSuccess": False, "message": f"{label} not found"}), 404
+
+    response = Response(rendered.data, mimetype=rendered.content_type)
+    response.set_etag(rendered.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = IMAGE_CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+
+@app.route('/barcode/<unique_id>', methods=['GET'])
+def get_barcode_api(unique_id):
+    return serve_code_image("barcode", unique_id, "Barcode")
+
+
+@app.route('/qrcode/<unique_id>', methods=['GET'])
+def get_qr_api(unique_id):
+    return serve_code_image("qr", unique_id, "QR Code")
+
+
+# Write-Behind Queue
+#
+# In async mode a v2 request only renders: the image is returned right away
+# and the upload + INSERT are journalled to a local SQLite spool, then
+# performed by background workers with exponential backoff. The spool is
+# shared by all gunicorn workers on the host and survives restarts.
+
+_write_behind_spool = None
+_write_behind_lock = threading.Lock()
+_write_behind_wakeup = threading.Event()
+_write_behind_checked = False
+
+# A write-behind result is cached before its upload and INSERT run, maybe in
+# another worker. Until this process has seen the job done, a cache hit on the
+# result asks the spool whether the job failed for good.
+_unsettled_jobs = set()
+_unsettled_jobs_lock = threading.Lock()
+
+def get_write_behind_spool():
+    """Opens the spool and starts this process's workers on first use."""
+    global _write_behind_spool
+    with _write_behind_lock:
+        if _write_behind_spool is None:
+            _write_behind_spool = Spool(WRITE_BEHIND_SPOOL)
+            for i in range(WRITE_BEHIND_WORKERS):
+                threading.Thread(target=_write_behind_worker, name=f"write-behind-{i}", daemon=True).start()
+        return _write_behind_spool
+
+
+def _write_behind_worker():
+    spool = _write_behind_spool
+    last_prune = 0
+    while True:
+        try:
+            job = spool.claim()
+        except Exception as e:
+            print(f"Write-behind spool error: {e}")
+            job = None
+        if job is None:
+            if time.time() - last_prune > 3600:
+                last_prune = time.time()
+                try:
+                    spool.prune(older_than=86400)
+                except Exception as e:
+                    print(f"Write-behind spool error: {e}")
+                settle_write_behind_results()
+            _write_behind_wakeup.wait(1.0)
+            _write_behind_wakeup.clear()
+            continue
+        try:
+            process_write_behind_job(spool, job)
+        except Exception as e:
+            # Unexpected (a locked spool, say): retry with backoff rather
+            # than lose this thread and leave the job leased.
+            print(f"Write-behind job {job['unique_id']} error: {e}")
+            try:
+                _retry_write_behind_job(spool, job, f"Error: {e}")
+            except Exception as e:
+                print(f"Write-behind spool error: {e}")
+
+
+def process_write_behind_job(spool, job):
+    unique_id = job["unique_id"]
+    rendered = RenderedImage(job["image"], job["content_type"], job["extension"])
+
+    url = job["url"]
+    if not job["uploaded"]:
+        url = upload_to_supabase(rendered, unique_id, job["bucket"], upsert=True)
+        if not url:
+            return _retry_write_behind_job(spool, job, "Failed to upload")
+        spool.mark_uploaded(unique_id, url)
+
+    if job["kind"] == "barcode":
+        stored = store_barcode_in_db(job["name"], unique_id, url, rendered)
+    else:
+        stored = store_qr_in_db(job["name"], unique_id, url, rendered, job["render_options"])
+    if not stored:
+        return _retry_write_behind_job(spool, job, "Failed to store in database")
+    spool.complete(unique_id)
+    with _unsettled_jobs_lock:
+        _unsettled_jobs.discard(unique_id)
+
+
+def _retry_write_behind_job(spool, job, error):
+    if job["attempts"] >= WRITE_BEHIND_MAX_ATTEMPTS:
+        print(f"Write-behind job {job['unique_id']} failed permanently: {error}")
+        spool.fail(job["unique_id"], error)
+        forget_write_behind_result(job["unique_id"])
+        return
+    delay = min(WRITE_BEHIND_BACKOFF_MAX, WRITE_BEHIND_BACKOFF_BASE * 2 ** (job["attempts"] - 1))
+    spool.retry(job["unique_id"], error, delay * random.uniform(0.5, 1.0))
+
+
+def forget_write_behind_result(unique_id):
+    # The cached URL was never uploaded (or its row never inserted): the next
+    # request for the value must generate it again.
+    result_cache.discard(unique_id)
+    image_cache.discard(unique_id)
+    with _unsettled_jobs_lock:
+        _unsettled_jobs.discard(unique_id)
+
+
+def write_behind_unsettled(unique_id):
+    """True if unique_id is a write-behind job of this process not yet seen done."""
+    with _unsettled_jobs_lock:
+        return unique_id in _unsettled_jobs
+
+
+def write_behind_result_live(unique_id):
+    """False if unique_id's write-behind job failed for good; its cache entries are then dropped."""
+    if not write_behind_unsettled(unique_id):
+        return True
+    try:
+        status = get_write_behind_spool().status(unique_id)
+    except Exception as e:
+        print(f"Write-behind spool error: {e}")
+        return True
+    state = status["state"] if status is not None else "done"  # pruned: done long ago
+    if state == "failed":
+        forget_write_behind_result(unique_id)
+        return False
+    if state == "done":
+        with _unsettled_jobs_lock:
+            _unsettled_jobs.discard(unique_id)
+    return True
+
+
+def settle_write_behind_results():
+    """Checks every unsettled job, so results never hit again do not pile up."""
+    with _unsettled_jobs_lock:
+        unique_ids = list(_unsettled_jobs)
+    for unique_id in unique_ids:
+        write_behind_result_live(unique_id)
+
+
+def load_pending_image(kind, unique_id):
+    """Returns the image of a write-behind job that is not committed yet."""
+    if _write_behind_spool is None and not os.path.exists(WRITE_BEHIND_SPOOL):
+        return None
+    try:
+        job = get_write_behind_spool().pending_image(unique_id)
+    except Exception as e:
+        print(f"Write-behind spool error: {e}")
+        return None
+    if job is None or job["kind"] != kind:
+        return None
+    return RenderedImage(job["image"], job["content_type"], job["extension"])
+
+
+def enqueue_write_behind(kind, name, unique_id, bucket, rendered, render_options=None):
+    """Journals the upload + INSERT for later; returns the final URL or None."""
+    try:
+        url = public_url(unique_id, bucket, rendered.extension)
+        get_write_behind_spool().enqueue(unique_id, kind, name, bucket, rendered, url, render_options)
+        with _unsettled_jobs_lock:
+            _unsettled_jobs.add(unique_id)
+        _write_behind_wakeup.set()
+        return url
+    except Exception as e:
+        print(f"Error queueing write-behind job: {e}")
+        return None
+
+
+def wants_write_behind(data):
+    value = data.get("async", WRITE_BEHIND_DEFAULT)
+    return value is True or value == 1 or value == "true"
+
+
+@app.before_request
+def resume_write_behind():
+    # Start workers after a restart so jobs left in the spool are finished
+    # even if no new async request arrives.
+    global _write_behind_checked
+    if not _write_behind_checked:
+        _write_behind_checked = True
+        if os.path.exists(WRITE_BEHIND_SPOOL):
+            try:
+                get_write_behind_spool()
+            except Exception as e:
+                print(f"Write-behind spool error: {e}")
+
+
+@app.route('/status/<unique_id>', methods=['GET'])
+def write_behind_status_api(unique_id):
+    try:
+        status = get_write_behind_spool().status(unique_id)
+    except Exception as e:
+        print(f"Write-behind spool error: {e}")
+        return jsonify({"isSuccess": False, "message": "Status unavailable"}), 503
+    if status is None:
+        return jsonify({"isSuccess": False, "message": "Unknown unique_id"}), 404
+    return jsonify({"isSuccess": True, "committed": status["state"] == "done", "status": status}), 200
+
+
+# kind: (response key, URL field, base64 field, label)
+V2_FIELDS = {
+    "barcode": ("barcode", "barcode_image_path", "barcode_image_base64", "Barcode"),
+    "qr": ("qr_code", "qr_code_image_path", "qr_code_image_base64", "QR Code"),
+}
+
+def code_json(kind, unique_id, url, rendered, embed_image=True, **extra):
+    """The v2 response body for a generated code; extra adds top-level fields."""
+    key, url_field, base64_field, label = V2_FIELDS[kind]
+    code = {"unique_id": unique_id, url_field: url}
+    if embed_image:
+        code[base64_field] = image_to_base64(rendered)
+    return {"isSuccess": True, "message": f"{label} generated", **extra, key: code}
+
+
+def pending_fields(unique_id):
+    return {"status": "pending", "status_url": f"/status/{unique_id}"}
+
+
+# v2 Response Formats
+#
+# JSON with the image base64-encoded stays the default. A client that only
+# wants the image asks for it with Accept (or a "format" field) and gets the
+# bytes, with the JSON fields as headers; multipart/mixed carries the JSON
+# (without base64) and the image in one response. Neither pays for base64.
+# An image format asked for this way is also the one uploaded and stored;
+# JSON and multipart responses use OUTPUT_FORMAT.
+
+RESPONSE_FORMATS = {
+    "json": "application/json",
+    # image/* gets OUTPUT_FORMAT: it is listed first among the image types.
+    **{fmt: formats.FORMATS[fmt][0] for fmt in sorted(formats.FORMATS, key=lambda fmt: fmt != OUTPUT_FORMAT)},
+    "multipart": "multipart/mixed",
+}
+IMAGE_ROUTES = {"barcode": "/barcode", "qr": "/qrcode"}
+NEGOTIATED_ROUTES = ("/generate_barcode_v2", "/generate_qrcode_v2")  # every response carries Vary: Accept
+
+def response_format(data, accept):
+    """Picks the v2 response format: the "format" field, else the Accept header.
+
+    Raises ValueError for an unknown "format"; returns None when the Accept
+    header rules out every format (406).
+    """
+    requested = data.get("format")
+    if requested is not None:
+        if not isinstance(requested, str) or requested not in RESPONSE_FORMATS:
+            raise ValueError(f"format must be one of {', '.join(RESPONSE_FORMATS)}")
+        return requested
+    if not accept:
+        return "json"
+    best = accept.best_match(RESPONSE_FORMATS.values())
+    return next((name for name, content_type in RESPONSE_FORMATS.items() if content_type == best), None)
+
+def image_format(fmt):
+    """The output format a response format is sent in."""
+    return fmt if fmt in formats.FORMATS else OUTPUT_FORMAT
+
+def render_as(rendered, fmt, render, *args):
+    """rendered, or the same code rendered again in fmt if it was stored in another format.
+
+    Only the response changes: the stored image and its URL are left as they are.
+    Returns None if rendering fails.
+    """
+    if rendered.format == fmt:
+        return rendered
+    try:
+        return render(*args, fmt=fmt)
+    except Exception as e:
+        print(f"Error rendering as {fmt}: {e}")
+        return None
+
+def not_acceptable_json():
+    return {"isSuccess": False, "message": f"Not acceptable; available: {', '.join(RESPONSE_FORMATS.values())}"}
+
+def code_headers(kind, unique_id, url, rendered, **extra):
+    """The v2 JSON fields of a code as response headers (image and multipart formats)."""
+    headers = {
+        "X-Unique-Id": unique_id,
+        "X-Image-Url": url or "",
+        "Location": f"{IMAGE_ROUTES[kind]}/{unique_id}",
+        "ETag": f'"{rendered.etag}"',
+    }
+    for name, value in extra.items():
+        header = "X-" + name.replace("_", "-").title()
+        headers[header] = str(value).lower() if isinstance(value, bool) else str(value)
+    return headers
+
+def multipart_body(parts):
+    """Encodes [(headers, bytes)] as multipart/mixed; returns (body, content type)."""
+    boundary = f"code-{random.getrandbits(64):016x}"
+    chunks = []
+    for headers, data in parts:
+        chunks.append(f"--{boundary}\r\n".encode())
+        chunks.append("".join(f"{name}: {value}\r\n" for name, value in headers.items()).encode())
+        chunks += [b"\r\n", data, b"\r\n"]
+    chunks.append(f"--{boundary}--\r\n".encode())
+    return b"".join(chunks), f"multipart/mixed; boundary={boundary}"
+
+def code_payload(fmt, kind, unique_id, url, rendered, **extra):
+    """A v2 response in a non-JSON format: (body bytes, headers incl. Content-Type)."""
+    headers = code_headers(kind, unique_id, url, rendered, **extra)
+    disposition = f'inline; filename="{unique_id}.{rendered.extension}"'
+    if fmt == "multipart":
+        body, content_type = multipart_body([
+            ({"Content-Type": "application/json"},
+             json.dumps(code_json(kind, unique_id, url, rendered, embed_image=False, **extra), separators=(",", ":")).encode()),
+            ({"Content-Type": rendered.content_type, "Content-Disposition": disposition}, rendered.data),
+        ])
+        headers["Content-Type"] = content_type
+        return body, headers
+    headers["Content-Type"] = rendered.content_type
+    headers["Content-Disposition"] = disposition
+    return rendered.data, headers
+
+def code_response(fmt, status_code, kind, unique_id, url, rendered, **extra):
+    if fmt == "json":
+        return jsonify(code_json(kind, unique_id, url, rendered, **extra)), status_code
+    body, headers = code_payload(fmt, kind, unique_id, url, rendered, **extra)
+    return Response(body, status=status_code, headers=headers)
+
+@app.after_request
+def vary_on_accept(response):
+    # Errors too: a shared cache must not give one client's 406 to the next.
+    if request.path in NEGOTIATED_ROUTES:
+        response.vary.add("Accept")
+    return response
+
+
 @app.route('/generate_barcode_v2', methods=['POST'])
 def generate_barcode_api_v2():
     data = request.json
@@ -311,19 +1501,42 @@ def generate_barcode_api_v2():
     if not value:
         return jsonify({"isSuccess": False, "message": "Missing required field: text"}), 400
 
-    barcode_path, unique_id = generate_barcode_new(value)
-    if not barcode_path:
+    try:
+        fmt = response_format(data, request.accept_mimetypes)
+    except ValueError as e:
+        return jsonify({"isSuccess": False, "message": str(e)}), 400
+    if fmt is None:
+        return jsonify(not_acceptable_json()), 406
+
+    cached = get_cached_code("code128", value, DEFAULT_RENDER_OPTIONS, lookup_barcode_in_db)
+    if cached:
+        unique_id, barcode_url, rendered = cached
+        rendered = render_as(rendered, image_format(fmt), render_barcode, value)
+        if not rendered:
+            return jsonify({"isSuccess": False, "message": "Failed to generate barcode"}), 500
+        return code_response(fmt, 201, "barcode", unique_id, barcode_url, rendered, cached=True)
+
+    rendered, unique_id = generate_barcode_new(value, image_format(fmt))
+    if not rendered:
         return jsonify({"isSuccess": False, "message": "Failed to generate barcode"}), 500
 
-    barcode_url = upload_to_supabase(barcode_path, unique_id, SUPABASE_BUCKET)
+    if wants_write_behind(data):
+        barcode_url = enqueue_write_behind("barcode", value, unique_id, SUPABASE_BUCKET, rendered)
+        if barcode_url:
+            result_cache.put(("code128", value, DEFAULT_RENDER_OPTIONS), (unique_id, barcode_url, rendered))
+            image_cache.put(("barcode", unique_id), (unique_id, barcode_url, rendered))
+            return code_response(fmt, 202, "barcode", unique_id, barcode_url, rendered, **pending_fields(unique_id))
+
+    barcode_url = upload_to_supabase(rendered, unique_id, SUPABASE_BUCKET)
     if not barcode_url:
         return jsonify({"isSuccess": False, "message": "Failed to upload barcode"}), 500
 
-    store_barcode_in_db(value, unique_id, barcode_url, barcode_path)
-
-    barcode_base64 = image_to_base64(barcode_path)
+    # A code whose row failed to insert is not cached, so the next request retries it.
+    if store_barcode_in_db(value, unique_id, barcode_url, rendered):
+        result_cache.put(("code128", value, DEFAULT_RENDER_OPTIONS), (unique_id, barcode_url, rendered))
+        image_cache.put(("barcode", unique_id), (unique_id, barcode_url, rendered))
 
-    return jsonify({"isSuccess": True, "message": "Barcode generated", "barcode": {"unique_id": unique_id, "barcode_image_path": barcode_url, "barcode_image_base64": barcode_base64}}), 201
+    return code_response(fmt, 201, "barcode", unique_id, barcode_url, rendered)
 
 
 @app.route('/generate_qrcode_v2', methods=['POST'])
@@ -334,19 +1547,51 @@ def generate_qr_api_v2():
     if not value:
         return jsonify({"isSuccess": False, "message": "Missing required field: text"}), 400
 
-    qr_path, unique_id = generate_qr_code_new(value)
-    if not qr_path:
+    try:
+        options = parse_qr_options(data)
+    except ValueError as e:
+        return jsonify({"isSuccess": False, "message": str(e)}), 400
+    cache_options = tuple(sorted(options.items()))
+
+    try:
+        fmt = response_format(data, request.accept_mimetypes)
+    except ValueError as e:
+        return jsonify({"isSuccess": False, "message": str(e)}), 400
+    if fmt is None:
+        return jsonify(not_acceptable_json()), 406
+
+    cached = get_cached_code("qr", value, cache_options, lookup_qr_in_db)
+    if cached:
+        unique_id, qr_url, rendered = cached
+        rendered = render_as(rendered, image_format(fmt), render_qr_code, value, options)
+        if not rendered:
+            return jsonify({"isSuccess": False, "message": "Failed to generate QR Code"}), 500
+        return code_response(fmt, 201, "qr", unique_id, qr_url, rendered, cached=True)
+
+    try:
+        rendered, unique_id = generate_qr_code_new(value, options, image_format(fmt))
+    except DataOverflowError:
+        return jsonify({"isSuccess": False, "message": qr_overflow_message(options)}), 400
+    if not rendered:
         return jsonify({"isSuccess": False, "message": "Failed to generate QR Code"}), 500
 
-    qr_url = upload_to_supabase(qr_path, unique_id, QR_SUPABASE_BUCKET)
+    if wants_write_behind(data):
+        qr_url = enqueue_write_behind("qr", value, unique_id, QR_SUPABASE_BUCKET, rendered, render_options_text(options))
+        if qr_url:
+            result_cache.put(("qr", value, cache_options), (unique_id, qr_url, rendered))
+            image_cache.put(("qr", unique_id), (unique_id, qr_url, rendered))
+            return code_response(fmt, 202, "qr", unique_id, qr_url, rendered, **pending_fields(unique_id))
+
+    qr_url = upload_to_supabase(rendered, unique_id, QR_SUPABASE_BUCKET)
     if not qr_url:
         return jsonify({"isSuccess": False, "message": "Failed to upload QR Code"}), 500
 
-    store_qr_in_db(value, unique_id, qr_url, qr_path)
-
-    qr_base64 = image_to_base64(qr_path)
+    # A code whose row failed to insert is not cached, so the next request retries it.
+    if store_qr_in_db(value, unique_id, qr_url, rendered, render_options_text(options)):
+        result_cache.put(("qr", value, cache_options), (unique_id, qr_url, rendered))
+        image_cache.put(("qr", unique_id), (unique_id, qr_url, rendered))
 
-    return jsonify({"isSuccess": True, "message": "QR Code generated", "qr_code": {"unique_id": unique_id, "qr_code_image_path": qr_url, "qr_code_image_base64": qr_base64}}), 201
+    return code_response(fmt, 201, "qr", unique_id, qr_url, rendered)
 
 
 # @app.route('/generate_barcode_v2', methods=['POST'])
@@ -392,6 +1637,9 @@ def generate_qr_api_v2():
 
 
 
+_startup["import_seconds"] = time.monotonic() - _import_started
+metrics.IMPORT_SECONDS.set(_startup["import_seconds"])
+
 if __name__ == '__main__':
     app.run(port=5001, threaded=True)
 
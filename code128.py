@@ -0,0 +1,273 @@
+"""Code-128 encoder and NumPy rasterizer.
+
+Drop-in replacement for ``barcode.get_barcode_class('code128')`` with
+``ImageWriter``: charset selection, checksum and geometry follow python-barcode
+exactly, so the rendered symbols are pixel-identical, but a symbol is drawn as
+one row of modules broadcast to the bar height instead of one PIL rectangle per
+bar. svg() writes the same geometry as a vector document.
+"""
+import importlib.util
+import os
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# Symbol patterns as bar/space widths, indexed by symbol value (0-105).
+_WIDTHS = (
+    "212222 222122 222221 121223 121322 131222 122213 122312 132212 221213 "
+    "221312 231212 112232 122132 122231 113222 123122 123221 223211 221132 "
+    "221231 213212 223112 312131 311222 321122 321221 312212 322112 322211 "
+    "212123 212321 232121 111323 131123 131321 112313 132113 132311 211313 "
+    "231113 231311 112133 112331 132131 113123 113321 133121 313121 211331 "
+    "231131 213113 213311 213131 311123 311321 331121 312113 312311 332111 "
+    "314111 221411 431111 111224 111422 121124 121421 141122 141221 112214 "
+    "112412 122114 122411 142112 142211 241211 221114 413111 241112 134111 "
+    "111242 121142 121241 114212 124112 124211 411212 421112 421211 212141 "
+    "214121 412121 111143 111341 131141 114113 114311 411113 411311 113141 "
+    "114131 311141 411131 211412 211214 211232"
+).split()
+# Stop pattern followed by the two-module termination bar.
+_STOP_WIDTHS = "2331112"
+
+START_A, START_B, START_C = 103, 104, 105
+_SWITCH = {"A": 101, "B": 100, "C": 99}  # value of "switch to <charset>" in the other charsets
+
+_COMMON = "".join(chr(c) for c in range(0x20, 0x60))
+_CHARSET_A = {c: i for i, c in enumerate(_COMMON + "".join(chr(c) for c in range(0x20)))}
+_CHARSET_B = {c: i for i, c in enumerate(_COMMON + "".join(chr(c) for c in range(0x60, 0x80)))}
+# FNC1-FNC4, written as the characters python-barcode uses for them.
+_CHARSET_A.update({"ó": 96, "ò": 97, "ô": 101, "ñ": 102})
+_CHARSET_B.update({"ó": 96, "ò": 97, "ô": 100, "ñ": 102})
+
+# ImageWriter defaults as applied by python-barcode's Code128.render().
+MODULE_WIDTH = 0.2
+MODULE_HEIGHT = 15.0
+QUIET_ZONE = 2.54
+FONT_SIZE = 10
+TEXT_DISTANCE = 5.0
+MARGIN_TOP = 1.0
+MARGIN_BOTTOM = 1.0
+TEXT_LINE_DISTANCE = 1.0
+DPI = 300
+
+
+def _mm2px(mm, dpi):
+    return (mm * dpi) / 25.4
+
+
+def _pt2mm(pt):
+    return pt * 0.352777778
+
+
+def encode(value):
+    """Returns the symbol values for value: start code, data and checksum."""
+    for char in value:
+        if char not in _CHARSET_A and char not in _CHARSET_B:
+            raise ValueError(f"Character {char!r} cannot be encoded in Code 128")
+
+    charset = "C"
+    buffer = ""
+    encoded = [START_C]
+    leading_switch = False
+
+    def convert(char):
+        nonlocal buffer
+        if charset == "A":
+            return _CHARSET_A[char]
+        if charset == "B":
+            return _CHARSET_B[char]
+        if char.isdigit():
+            buffer += char
+            if len(buffer) == 2:
+                pair, buffer = int(buffer), ""
+                return pair
+            return None
+        raise ValueError(f"Character {char!r} could not be converted in charset C")
+
+    def digits_ahead(pos):
+        digits = 0
+        for char in value[pos:pos + 10]:
+            if not char.isdigit():
+                break
+            digits += 1
+        return digits > 3
+
+    for pos, char in enumerate(value):
+        # Same switching heuristic as python-barcode, so symbols stay identical.
+        if charset == "C" and not char.isdigit():
+            switch_to = "B" if char in _CHARSET_B else "A"
+            leading_switch = leading_switch or len(encoded) == 1
+            encoded.append(_SWITCH[switch_to])
+            charset = switch_to
+            if len(buffer) == 1:
+                encoded.append(convert(buffer))
+                buffer = ""
+        elif charset in "AB":
+            other = "B" if charset == "A" else "A"
+            current_set = _CHARSET_A if charset == "A" else _CHARSET_B
+            other_set = _CHARSET_B if charset == "A" else _CHARSET_A
+            if digits_ahead(pos):
+                encoded.append(_SWITCH["C"])
+                charset = "C"
+            elif char not in current_set and char in other_set:
+                encoded.append(_SWITCH[other])
+                charset = other
+        code = convert(char)
+        if code is not None:
+            encoded.append(code)
+
+    if len(buffer) == 1:
+        leading_switch = leading_switch or len(encoded) == 1
+        encoded.append(_SWITCH["B"])
+        charset = "B"
+        encoded.append(_CHARSET_B[buffer])
+
+    # A leading charset switch is folded into the start code. python-barcode
+    # also folds a leading data pair "99" (so "9912" encodes as "12"); only
+    # genuine switches are folded here.
+    if leading_switch:
+        encoded[:2] = [{101: START_A, 100: START_B}[encoded[1]]]
+
+    checksum = encoded[0]
+    for weight, code in enumerate(encoded[1:], start=1):
+        checksum += weight * code
+    encoded.append(checksum % 103)
+    return encoded
+
+
+def run_lengths(value):
+    """Returns the alternating bar/space widths (in modules) of the symbol, starting with a bar."""
+    widths = "".join(_WIDTHS[code] for code in encode(value)) + _STOP_WIDTHS
+    return np.frombuffer(widths.encode("ascii"), dtype=np.uint8) - ord("0")
+
+
+def modules(value):
+    """Returns the symbol as a 1-D array of modules (1 = bar, 0 = space)."""
+    runs = run_lengths(value)
+    return np.repeat(np.arange(len(runs)) % 2 == 0, runs).astype(np.uint8)
+
+
+@lru_cache(maxsize=None)
+def _default_font_path():
+    # python-barcode ships the font its ImageWriter uses; reuse it so text matches.
+    spec = importlib.util.find_spec("barcode")
+    if spec and spec.origin:
+        path = os.path.join(os.path.dirname(spec.origin), "fonts", "DejaVuSansMono.ttf")
+        if os.path.exists(path):
+            return path
+    return "DejaVuSansMono.ttf"
+
+
+@lru_cache(maxsize=16)
+def _font(path, size):
+    return ImageFont.truetype(path, size)
+
+
+def _bar_row(runs, width_px, module_width, quiet_zone, dpi):
+    """Rasterizes one row of bars exactly as ImageWriter paints its rectangles."""
+    # Positions accumulate run by run, like python-barcode's xpos, so float
+    # rounding (and hence PIL's truncation to pixels) matches it exactly.
+    edges = np.cumsum(np.concatenate(([quiet_zone], module_width * runs.astype(np.float64))))
+    starts = (edges[:-1] * dpi / 25.4).astype(np.int64)
+    ends = (edges[1:] * dpi / 25.4 - 1).astype(np.int64)
+    is_bar = np.arange(len(runs)) % 2 == 0
+
+    # Later rectangles paint over earlier ones; starts and ends are both
+    # non-decreasing, so each column takes the last run starting at or before it.
+    columns = np.arange(width_px)
+    last = np.searchsorted(starts, columns, side="right") - 1
+    covered = (last >= 0) & (ends[np.maximum(last, 0)] >= columns)
+    return np.where(covered & is_bar[np.maximum(last, 0)], 0, 255).astype(np.uint8), edges[0], edges[-1]
+
+
+def render(value, module_width=MODULE_WIDTH, module_height=MODULE_HEIGHT, quiet_zone=QUIET_ZONE,
+           text=True, font_size=FONT_SIZE, text_distance=TEXT_DISTANCE, dpi=DPI, font_path=None):
+    """Renders value as a grayscale (mode "L") PIL image.
+
+    text may be True (print value), False/None (bars only) or a string to print
+    instead of value. Sizes are in millimetres, font_size in points.
+    """
+    return render_many([value], module_width, module_height, quiet_zone, text, font_size,
+                       text_distance, dpi, font_path)[0]
+
+
+def render_many(values, module_width=MODULE_WIDTH, module_height=MODULE_HEIGHT, quiet_zone=QUIET_ZONE,
+                text=True, font_size=FONT_SIZE, text_distance=TEXT_DISTANCE, dpi=DPI, font_path=None):
+    """Renders many values in one call; see render() for the options."""
+    texts = [value if text is True else (text or "") for value in values]
+    font_px = int(_mm2px(_pt2mm(font_size), dpi))
+    font = _font(font_path or _default_font_path(), font_px) if font_px > 0 and any(texts) else None
+
+    bar_top = int(_mm2px(MARGIN_TOP, dpi))
+    bar_bottom = int(_mm2px(MARGIN_TOP + module_height, dpi))
+
+    images = []
+    for value, label in zip(values, texts):
+        runs = run_lengths(value)
+        width = 2 * quiet_zone + int(runs.sum()) * module_width
+        height = MARGIN_BOTTOM + MARGIN_TOP + module_height
+        lines = label.splitlines()
+        if font_size and label:
+            height += _pt2mm(font_size) / 2 * len(lines) + text_distance
+            height += TEXT_LINE_DISTANCE * (len(lines) - 1)
+        width_px, height_px = int(_mm2px(width, dpi)), int(_mm2px(height, dpi))
+
+        row, bars_start, bars_end = _bar_row(runs, width_px, module_width, quiet_zone, dpi)
+        pixels = np.full((height_px, width_px), 255, dtype=np.uint8)
+        pixels[bar_top:min(bar_bottom + 1, height_px)] = row
+        image = Image.fromarray(pixels)
+
+        if label and font is not None:
+            draw = ImageDraw.Draw(image)
+            xpos = bars_start + (bars_end - bars_start) / 2.0
+            ypos = MARGIN_TOP + module_height + text_distance
+            for line in label.split("\n"):
+                draw.text((_mm2px(xpos, dpi), _mm2px(ypos, dpi)), line, font=font, fill=0, anchor="md")
+                ypos += _pt2mm(font_size) / 2 + TEXT_LINE_DISTANCE
+        images.append(image)
+    return images
+
+
+def _mm(value):
+    return f"{value:.3f}".rstrip("0").rstrip(".")
+
+
+def svg(value, module_width=MODULE_WIDTH, module_height=MODULE_HEIGHT, quiet_zone=QUIET_ZONE,
+        text=True, font_size=FONT_SIZE, text_distance=TEXT_DISTANCE):
+    """Renders value as an SVG document (bytes) with render()'s layout, in millimetres.
+
+    The bars are a single path; the text is set in the viewer's monospace font.
+    """
+    label = value if text is True else (text or "")
+    runs = run_lengths(value)
+    edges = np.cumsum(np.concatenate(([quiet_zone], module_width * runs.astype(np.float64))))
+    width = 2 * quiet_zone + int(runs.sum()) * module_width
+    height = MARGIN_BOTTOM + MARGIN_TOP + module_height
+    lines = label.splitlines()
+    if font_size and label:
+        height += _pt2mm(font_size) / 2 * len(lines) + text_distance
+        height += TEXT_LINE_DISTANCE * (len(lines) - 1)
+
+    bars = "".join(
+        f"M{_mm(edges[i])} {_mm(MARGIN_TOP)}h{_mm(edges[i + 1] - edges[i])}v{_mm(module_height)}H{_mm(edges[i])}z"
+        for i in range(0, len(runs), 2)
+    )
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{_mm(width)}mm" height="{_mm(height)}mm" '
+        f'viewBox="0 0 {_mm(width)} {_mm(height)}">',
+        f'<rect width="100%" height="100%" fill="#fff"/><path d="{bars}"/>',
+    ]
+    if font_size and label:
+        xpos = edges[0] + (edges[-1] - edges[0]) / 2.0
+        ypos = MARGIN_TOP + module_height + text_distance
+        parts.append(f'<g font-family="DejaVu Sans Mono,monospace" font-size="{_mm(_pt2mm(font_size))}" '
+                     f'text-anchor="middle">')
+        for line in label.split("\n"):
+            line = "".join(char for char in line if char >= " ")  # control characters are not valid XML
+            parts.append(f'<text x="{_mm(xpos)}" y="{_mm(ypos)}">{escape(line)}</text>')
+            ypos += _pt2mm(font_size) / 2 + TEXT_LINE_DISTANCE
+        parts.append("</g>")
+    parts.append("</svg>")
+    return "".join(parts).encode("utf-8")
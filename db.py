@@ -0,0 +1,297 @@
+"""Postgres connection pooling and group-commit inserts.
+
+ConnectionPool wraps psycopg2's ThreadedConnectionPool: checkouts wait for a
+free connection instead of failing when the pool is exhausted, connections
+are health-checked before reuse and discarded when broken, and a context
+manager guarantees every checkout is returned.
+
+GroupCommitWriter merges single-row INSERTs from concurrent requests into one
+multi-row INSERT (and one commit) every few milliseconds; AsyncGroupCommitWriter
+does the same for asyncio code on a psycopg 3 AsyncConnectionPool.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool
+from psycopg2.extras import execute_values
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Thread-safe, bounded pool with health checks and usage metrics."""
+
+    def __init__(self, minconn, maxconn, checkout_timeout=30.0, health_check_idle=30.0, in_use_gauge=None, **kwargs):
+        self.maxconn = maxconn
+        self.checkout_timeout = checkout_timeout
+        self.health_check_idle = health_check_idle
+        self._pool = pool.ThreadedConnectionPool(minconn, maxconn, **kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self.in_use = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.discarded = 0
+        # Optional metric (anything with inc()/dec()) following in_use.
+        self.in_use_gauge = in_use_gauge
+
+    def getconn(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.waits += 1
+            if not self._slots.acquire(timeout=self.checkout_timeout):
+                with self._lock:
+                    self.timeouts += 1
+                raise PoolTimeout(f"No database connection free after {self.checkout_timeout}s")
+        try:
+            conn = self._healthy_connection()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+        if self.in_use_gauge is not None:
+            self.in_use_gauge.inc()
+        return conn
+
+    def _healthy_connection(self):
+        for _ in range(self.maxconn + 1):
+            conn = self._pool.getconn()
+            if not conn.closed and self._is_alive(conn):
+                return conn
+            self._discard(conn)
+        raise psycopg2.OperationalError("Could not obtain a healthy database connection")
+
+    def _is_alive(self, conn):
+        # Only probe connections that sat idle long enough to have been dropped.
+        if time.monotonic() - self._last_used.get(id(conn), 0) < self.health_check_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        with self._lock:
+            self.discarded += 1
+            self._last_used.pop(id(conn), None)
+        try:
+            self._pool.putconn(conn, close=True)
+        except Exception:
+            pass
+
+    def putconn(self, conn, broken=False):
+        try:
+            if broken or conn.closed:
+                self._discard(conn)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                self._pool.putconn(conn)
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            if self.in_use_gauge is not None:
+                self.in_use_gauge.dec()
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Checks out a connection; rolls back on error and always returns it."""
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except Exception as e:
+            broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except Exception:
+                    broken = True
+            raise
+        finally:
+            self.putconn(conn, broken)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max": self.maxconn,
+                "in_use": self.in_use,
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "discarded": self.discarded,
+            }
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+class GroupCommitWriter:
+    """Batches concurrent single-row INSERTs into one execute_values per window.
+
+    write() blocks until the row's batch has committed and returns True, or
+    False if the row could not be inserted. If a batch fails, its rows are
+    retried one by one so a single bad row only fails its own request.
+    """
+
+    def __init__(self, connection_pool, insert_sql, max_delay=0.005, max_batch=500):
+        self.pool = connection_pool
+        self.insert_sql = insert_sql
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self.batches = 0
+        self.rows = 0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+            self._thread.start()
+
+    def submit(self, row):
+        future = Future()
+        with self._cond:
+            self._ensure_started()
+            self._pending.append((row, future))
+            self._cond.notify()
+        return future
+
+    def write(self, row, timeout=60):
+        try:
+            return self.submit(row).result(timeout)
+        except Exception as e:
+            print(f"Database Error (group commit): {e}")
+            return False
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Give concurrent requests a moment to join this batch.
+                deadline = time.monotonic() + self.max_delay
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+            self._flush(batch)
+
+    def _insert(self, rows):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                execute_values(cur, self.insert_sql, rows, page_size=len(rows))
+            conn.commit()
+
+    def _flush(self, batch):
+        try:
+            self._insert([row for row, _ in batch])
+            self.batches += 1
+            self.rows += len(batch)
+            for _, future in batch:
+                future.set_result(True)
+            return
+        except Exception as e:
+            if len(batch) == 1:
+                print(f"Database Error (group commit): {e}")
+                batch[0][1].set_result(False)
+                return
+        for row, future in batch:
+            try:
+                self._insert([row])
+                self.batches += 1
+                self.rows += 1
+                future.set_result(True)
+            except Exception as e:
+                print(f"Database Error (group commit): {e}")
+                future.set_result(False)
+
+
+class AsyncGroupCommitWriter:
+    """asyncio counterpart of GroupCommitWriter.
+
+    connection_pool is a psycopg 3 AsyncConnectionPool (or anything whose
+    connection() is an async context manager that commits on success).
+    insert_sql holds one row's placeholders, e.g.
+    "INSERT INTO t (a, b) VALUES (%s, %s)"; a batch is sent with executemany,
+    which psycopg pipelines into a single round trip.
+    """
+
+    def __init__(self, connection_pool, insert_sql, max_delay=0.005, max_batch=500):
+        self.pool = connection_pool
+        self.insert_sql = insert_sql
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._pending = []
+        self._task = None
+        self.batches = 0
+        self.rows = 0
+
+    async def write(self, row):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((row, future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        try:
+            return await future
+        except Exception as e:
+            print(f"Database Error (group commit): {e}")
+            return False
+
+    async def _run(self):
+        while self._pending:
+            # Give concurrent requests a moment to join this batch.
+            if len(self._pending) < self.max_batch:
+                await asyncio.sleep(self.max_delay)
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            await self._flush(batch)
+
+    async def _insert(self, rows):
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.executemany(self.insert_sql, rows)
+
+    async def _flush(self, batch):
+        try:
+            await self._insert([row for row, _ in batch])
+            self.batches += 1
+            self.rows += len(batch)
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(True)
+            return
+        except Exception as e:
+            if len(batch) == 1:
+                print(f"Database Error (group commit): {e}")
+                if not batch[0][1].done():
+                    batch[0][1].set_result(False)
+                return
+        for row, future in batch:
+            try:
+                await self._insert([row])
+                self.batches += 1
+                self.rows += 1
+                result = True
+            except Exception as e:
+                print(f"Database Error (group commit): {e}")
+                result = False
+            if not future.done():
+                future.set_result(result)
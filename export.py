@@ -0,0 +1,156 @@
+"""Streaming bulk export: NDJSON, ZIP and tiled multi-page PDF.
+
+Every writer consumes an iterable lazily and yields its encoded output piece
+by piece, so a response can start before the last item is rendered and memory
+is bounded by one item (one page for the PDF), whatever the batch size.
+"""
+import json
+import zipfile
+import zlib
+
+from PIL import Image
+
+DPI = 300
+# Page sizes in pixels at DPI.
+PAGE_SIZES = {
+    "A4": (2480, 3508),
+    "letter": (2550, 3300),
+}
+PAGE_MARGIN = 118  # 10 mm
+LABEL_GAP = 59  # 5 mm
+
+# Threshold for turning (JPEG-softened) grayscale labels back into pure black and white.
+_BILEVEL = [0] * 128 + [255] * 128
+
+
+def ndjson(records):
+    """Yields one JSON document per line."""
+    for record in records:
+        yield json.dumps(record, separators=(",", ":")) + "\n"
+
+
+class _Sink:
+    """Write-only file object that hands out what was written since the last drain()."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def zip_archive(files):
+    """Yields a ZIP archive of (filename, bytes) pairs.
+
+    Entries are stored uncompressed: the images are already compressed. The
+    archive is written to a non-seekable sink, so zipfile emits data
+    descriptors instead of seeking back to patch the local headers.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:
+        for filename, data in files:
+            archive.writestr(filename, data)
+            yield sink.drain()
+    yield sink.drain()
+
+
+def tile_pages(labels, page_size=PAGE_SIZES["A4"], margin=PAGE_MARGIN, gap=LABEL_GAP):
+    """Places PIL images row by row on pages; yields each page (mode "1") once it is full."""
+    page_width, page_height = page_size
+    usable_width = page_width - 2 * margin
+    usable_height = page_height - 2 * margin
+
+    page = None
+    x = y = row_height = 0
+    for label in labels:
+        label = label.convert("L")
+        if label.width > usable_width or label.height > usable_height:
+            label.thumbnail((usable_width, usable_height))
+
+        if page is not None and x and x + label.width > usable_width:
+            x, y, row_height = 0, y + row_height + gap, 0
+        if page is not None and y + label.height > usable_height:
+            yield page.point(_BILEVEL, "1")
+            page = None
+        if page is None:
+            page = Image.new("L", page_size, 255)
+            x = y = row_height = 0
+
+        page.paste(label, (margin + x, margin + y))
+        x += label.width + gap
+        row_height = max(row_height, label.height)
+
+    if page is None:
+        page = Image.new("L", page_size, 255)
+    yield page.point(_BILEVEL, "1")
+
+
+def pdf_document(pages, dpi=DPI):
+    """Yields a PDF with one full-page bilevel image per page.
+
+    Objects are written as soon as their page is available; the page tree and
+    cross-reference table, which need every page, come last.
+    """
+    offset = 0
+    offsets = {}
+    kids = []
+    next_number = 3  # 1 is the catalog, 2 the page tree
+
+    def emit(number, body, stream=None):
+        nonlocal offset
+        offsets[number] = offset
+        data = f"{number} 0 obj\n".encode("ascii") + body
+        if stream is not None:
+            data += b"\nstream\n" + stream + b"\nendstream"
+        data += b"\nendobj\n"
+        offset += len(data)
+        return data
+
+    header = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+    offset = len(header)
+    yield header + emit(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+
+    for page in pages:
+        image_number, content_number, page_number = next_number, next_number + 1, next_number + 2
+        next_number += 3
+        width_pt = page.width * 72 / dpi
+        height_pt = page.height * 72 / dpi
+
+        # Mode "1" rows are packed MSB first with 1 = white, as DeviceGray expects.
+        pixels = zlib.compress(page.tobytes(), 6)
+        content = f"q {width_pt:.2f} 0 0 {height_pt:.2f} 0 0 cm /Im0 Do Q".encode("ascii")
+        yield (
+            emit(image_number, (
+                f"<< /Type /XObject /Subtype /Image /Width {page.width} /Height {page.height} "
+                f"/ColorSpace /DeviceGray /BitsPerComponent 1 /Filter /FlateDecode /Length {len(pixels)} >>"
+            ).encode("ascii"), pixels)
+            + emit(content_number, f"<< /Length {len(content)} >>".encode("ascii"), content)
+            + emit(page_number, (
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width_pt:.2f} {height_pt:.2f}] "
+                f"/Resources << /XObject << /Im0 {image_number} 0 R >> >> /Contents {content_number} 0 R >>"
+            ).encode("ascii"))
+        )
+        kids.append(page_number)
+
+    pages_tree = emit(2, (
+        f"<< /Type /Pages /Kids [{' '.join(f'{kid} 0 R' for kid in kids)}] /Count {len(kids)} >>"
+    ).encode("ascii"))
+    xref_offset = offset
+    xref = [f"xref\n0 {next_number}\n", "0000000000 65535 f \n"]
+    xref.extend(f"{offsets[number]:010d} 00000 n \n" for number in range(1, next_number))
+    trailer = f"trailer\n<< /Size {next_number} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n"
+    yield pages_tree + "".join(xref).encode("ascii") + trailer.encode("ascii")
+
+
+def pdf_sheets(labels, page_size=PAGE_SIZES["A4"], dpi=DPI):
+    """Yields a multi-page PDF label sheet of PIL images."""
+    return pdf_document(tile_pages(labels, page_size), dpi)
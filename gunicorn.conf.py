@@ -0,0 +1,34 @@
+"""Gunicorn server hooks (settings stay on the start.sh command line)."""
+import os
+import sys
+
+
+def when_ready(server):
+    # With --preload the app is already imported in the master; warm it up
+    # once here so the workers fork with everything loaded.
+    if server.cfg.preload_app:
+        import barcode_gen
+        barcode_gen.warm_up()
+
+
+def post_fork(server, worker):
+    # Without --preload the app is imported later, in the worker, and its
+    # startup clock starts at that import instead.
+    barcode_gen = sys.modules.get("barcode_gen")
+    if barcode_gen is not None:
+        barcode_gen.worker_started()
+
+
+def post_worker_init(worker):
+    # Sync workers open their DB pool and storage client before taking
+    # requests; the ASGI app opens its own in before_serving.
+    barcode_gen = sys.modules.get("barcode_gen")
+    if barcode_gen is not None and not type(worker).__module__.startswith("uvicorn"):
+        barcode_gen.open_worker_clients()
+
+
+def child_exit(server, worker):
+    # Drop the exited worker's live gauges from the /metrics aggregate.
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
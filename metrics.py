@@ -0,0 +1,182 @@
+"""Prometheus metrics and slow-request profiling for the hot path.
+
+Under gunicorn, PROMETHEUS_MULTIPROC_DIR (set by start.sh) makes every worker
+write its samples to files in that directory, and /metrics aggregates all of
+them, whichever worker serves the scrape. Without it, metrics are per process.
+"""
+import cProfile
+import functools
+import itertools
+import os
+import random
+import threading
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+# Stages take from well under a millisecond (base64) to seconds (a slow upload).
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_SECONDS = Histogram(
+    "barcode_stage_duration_seconds", "Time spent in each hot-path stage.", ["stage"], buckets=STAGE_BUCKETS
+)
+STAGE_FAILURES = Counter("barcode_stage_failures_total", "Hot-path stage calls that failed.", ["stage"])
+REQUEST_SECONDS = Histogram(
+    "barcode_request_duration_seconds", "Time until the response is returned (streamed bodies excluded).",
+    ["method", "endpoint"], buckets=REQUEST_BUCKETS
+)
+REQUESTS = Counter("barcode_requests_total", "Requests by endpoint and status.", ["method", "endpoint", "status"])
+SLOW_REQUESTS = Counter("barcode_slow_requests_total", "Requests slower than SLOW_REQUEST_SECONDS.", ["endpoint"])
+PROFILES_SAVED = Counter("barcode_profiles_saved_total", "cProfile captures written for slow requests.")
+
+# livesum: summed over the workers that are still alive.
+DB_POOL_IN_USE = Gauge("barcode_db_pool_in_use", "Checked-out database connections.", multiprocess_mode="livesum")
+DB_POOL_MAX = Gauge("barcode_db_pool_max", "Database connections the pools may open.", multiprocess_mode="livesum")
+UPLOADS_IN_FLIGHT = Gauge("barcode_uploads_in_flight", "Storage uploads in progress.", multiprocess_mode="livesum")
+
+# Startup figures; liveall keeps one series per live worker (labelled by pid).
+IMPORT_SECONDS = Gauge("barcode_import_seconds", "Time taken to import the app module.", multiprocess_mode="max")
+WORKER_STARTUP_SECONDS = Gauge(
+    "barcode_worker_startup_seconds", "Worker startup phases: opening clients, time from start to first request.",
+    ["phase"], multiprocess_mode="liveall"
+)
+WORKER_MEMORY_BYTES = Gauge(
+    "barcode_worker_memory_bytes", "Worker memory at its first request (rss, pss, uss).", ["kind"],
+    multiprocess_mode="liveall"
+)
+
+
+def _failed(result):
+    # The instrumented helpers report failure by returning None/False
+    # (or (None, None) for the generate_* functions) rather than raising.
+    if isinstance(result, tuple):
+        return not result or result[0] is None
+    return result is None or result is False
+
+
+def timed(stage):
+    """Decorator recording the call's duration, and failures, under stage."""
+    def decorator(function):
+        histogram = STAGE_SECONDS.labels(stage)
+        failures = STAGE_FAILURES.labels(stage)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except Exception:
+                failures.inc()
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start)
+            if _failed(result):
+                failures.inc()
+            return result
+        return wrapper
+    return decorator
+
+
+def exposition():
+    """Returns (body, content type) of the current metrics in text format."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def process_memory():
+    """Returns this process's memory in bytes: {"rss", "pss", "uss"} on Linux.
+
+    Forked workers share the pages they inherited, so rss counts those in
+    every worker; pss splits them between the sharers and uss is what the
+    worker alone holds. Elsewhere only {"max_rss"} is available.
+    """
+    fields = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if value.strip().endswith("kB"):
+                    fields[key] = int(value.split()[0]) * 1024
+    except OSError:
+        import resource
+        return {"max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+class SlowRequestProfiler:
+    """Profiles a sample of requests and keeps the captures of slow ones.
+
+    Only one request per process is profiled at a time: the interpreter
+    allows a single active profiler. Captures are written as
+    <directory>/<time>-<pid>-<n>-<endpoint>-<ms>ms.prof (load with pstats or
+    snakeviz); the oldest are deleted beyond keep files.
+    """
+
+    def __init__(self, directory, sample_rate, threshold, keep=50):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.keep = keep
+        self._busy = threading.Lock()
+        self._sequence = itertools.count()
+
+    def start(self):
+        """Returns a running profiler if this request is sampled, else None."""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) is already active.
+            self._busy.release()
+            return None
+        return profile
+
+    def stop(self, profile, duration, endpoint):
+        if profile is None:
+            return
+        try:
+            profile.disable()
+        finally:
+            self._busy.release()
+        if duration < self.threshold:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            name = endpoint.strip("/").replace("/", "_").replace("<", "").replace(">", "") or "root"
+            filename = (
+                f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{next(self._sequence)}-{name}"
+                f"-{int(duration * 1000)}ms.prof"
+            )
+            path = os.path.join(self.directory, filename)
+            profile.dump_stats(path)
+            PROFILES_SAVED.inc()
+            self._prune()
+            print(f"Slow request profiled: {endpoint} took {duration:.3f}s, saved {path}")
+        except Exception as e:
+            print(f"Error saving profile: {e}")
+
+    def _prune(self):
+        files = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith(".prof")),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in files[:-self.keep]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
@@ -0,0 +1,320 @@
+"""QR code engine with NumPy rasterization.
+
+Produces the same symbols as ``qrcode.make()`` but keeps per-version layouts,
+masks and Reed-Solomon tables between calls, scores the eight masks with array
+operations instead of qrcode's per-module Python loops, and scales the module
+matrix to pixels with NumPy instead of drawing each module through
+``PilImage``. Callers can pin version, error correction, box size and border.
+svg() writes the same symbol as a vector document.
+"""
+from bisect import bisect_left
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+from qrcode import QRCode, base, exceptions, util
+from qrcode.LUT import rsPoly_LUT
+from qrcode.constants import ERROR_CORRECT_H, ERROR_CORRECT_L, ERROR_CORRECT_M, ERROR_CORRECT_Q
+
+ERROR_CORRECTION = {
+    "L": ERROR_CORRECT_L,
+    "M": ERROR_CORRECT_M,
+    "Q": ERROR_CORRECT_Q,
+    "H": ERROR_CORRECT_H,
+}
+
+# qrcode.make() defaults.
+ERROR_CORRECTION_DEFAULT = "M"
+BOX_SIZE = 10
+BORDER = 4
+
+# Finder-like 1:1:3:1:1 patterns with four light modules on either side.
+_FINDER_PATTERNS = np.array([
+    [1, 0, 1, 1, 1, 0, 1, 0, 0, 0, 0],
+    [0, 0, 0, 0, 1, 0, 1, 1, 1, 0, 1],
+], dtype=bool)
+
+
+class _BitWriter:
+    """util.BitBuffer replacement that appends whole values instead of single bits."""
+
+    def __init__(self):
+        self.value = 0
+        self.length = 0
+
+    def put(self, num, length):
+        self.value = (self.value << length) | (num & ((1 << length) - 1))
+        self.length += length
+
+    def __len__(self):
+        return self.length
+
+
+def _fit_version(data_list, error_correction, start=1):
+    """Smallest version that holds data_list; mirrors QRCode.best_fit."""
+    util.check_version(start)
+    mode_sizes = util.mode_sizes_for_version(start)
+    buffer = _BitWriter()
+    for data in data_list:
+        buffer.put(data.mode, 4)
+        buffer.put(len(data), mode_sizes[data.mode])
+        data.write(buffer)
+
+    version = bisect_left(util.BIT_LIMIT_TABLE[error_correction], len(buffer), start)
+    if version == 41:
+        raise exceptions.DataOverflowError()
+    if mode_sizes is not util.mode_sizes_for_version(version):
+        return _fit_version(data_list, error_correction, version)
+    return version
+
+
+@lru_cache(maxsize=None)
+def _rs_table(ec_count):
+    """Generator polynomial times every byte value, for Reed-Solomon division."""
+    if ec_count in rsPoly_LUT:
+        generator = rsPoly_LUT[ec_count]
+    else:
+        polynomial = base.Polynomial([1], 0)
+        for i in range(ec_count):
+            polynomial = polynomial * base.Polynomial([1, base.gexp(i)], 0)
+        generator = list(polynomial)
+    logs = [base.glog(c) for c in generator[1:]]
+    table = [[0] * ec_count]
+    for factor in range(1, 256):
+        log_factor = base.glog(factor)
+        table.append([base.gexp(log + log_factor) for log in logs])
+    return table
+
+
+def _codewords(version, error_correction, data_list):
+    """Data and error correction codewords; same result as util.create_data."""
+    buffer = _BitWriter()
+    for data in data_list:
+        buffer.put(data.mode, 4)
+        buffer.put(len(data), util.length_in_bits(data.mode, version))
+        data.write(buffer)
+
+    rs_blocks = base.rs_blocks(version, error_correction)
+    bit_limit = sum(block.data_count * 8 for block in rs_blocks)
+    if len(buffer) > bit_limit:
+        raise exceptions.DataOverflowError(
+            "Code length overflow. Data size (%s) > size available (%s)" % (len(buffer), bit_limit)
+        )
+
+    # Terminator, byte alignment, then alternating pad bytes up to the limit.
+    buffer.put(0, min(bit_limit - len(buffer), 4))
+    buffer.put(0, -len(buffer) % 8)
+    for i in range((bit_limit - len(buffer)) // 8):
+        buffer.put(util.PAD0 if i % 2 == 0 else util.PAD1, 8)
+    stream = buffer.value.to_bytes(len(buffer) // 8, "big")
+
+    dc_blocks, ec_blocks = [], []
+    offset = 0
+    for block in rs_blocks:
+        dc = stream[offset:offset + block.data_count]
+        offset += block.data_count
+        ec_count = block.total_count - block.data_count
+        table = _rs_table(ec_count)
+        remainder = [0] * ec_count
+        for byte in dc:
+            row = table[byte ^ remainder[0]]
+            remainder = [a ^ b for a, b in zip(remainder[1:] + [0], row)]
+        dc_blocks.append(dc)
+        ec_blocks.append(remainder)
+
+    codewords = []
+    for blocks in (dc_blocks, ec_blocks):
+        for i in range(max(len(block) for block in blocks)):
+            codewords.extend(block[i] for block in blocks if i < len(block))
+    return codewords
+
+
+@lru_cache(maxsize=None)
+def _layout(version):
+    """Returns (function pattern matrix, data module rows, data module cols) for version.
+
+    The function pattern matrix has the format/version areas blanked, as qrcode
+    does while scoring masks; data positions are listed in placement order.
+    """
+    count = version * 4 + 17
+    qr = QRCode(version=version)
+    qr.modules_count = count
+    qr.modules = [[None] * count for _ in range(count)]
+    qr.setup_position_probe_pattern(0, 0)
+    qr.setup_position_probe_pattern(count - 7, 0)
+    qr.setup_position_probe_pattern(0, count - 7)
+    qr.setup_position_adjust_pattern()
+    qr.setup_timing_pattern()
+    qr.setup_type_info(True, 0)
+    if version >= 7:
+        qr.setup_type_number(True)
+
+    # Same zig-zag walk as QRCode.map_data.
+    rows, cols = [], []
+    inc, row = -1, count - 1
+    for col in range(count - 1, 0, -2):
+        if col <= 6:
+            col -= 1
+        while True:
+            for c in (col, col - 1):
+                if qr.modules[row][c] is None:
+                    rows.append(row)
+                    cols.append(c)
+            row += inc
+            if row < 0 or count <= row:
+                row -= inc
+                inc = -inc
+                break
+
+    base = np.array([[bool(module) for module in line] for line in qr.modules], dtype=bool)
+    return base, np.array(rows), np.array(cols)
+
+
+@lru_cache(maxsize=None)
+def _masks(version):
+    """Returns the eight mask patterns evaluated at the data positions of version."""
+    _, i, j = _layout(version)
+    return np.array([
+        (i + j) % 2 == 0,
+        i % 2 == 0,
+        j % 3 == 0,
+        (i + j) % 3 == 0,
+        (i // 2 + j // 3) % 2 == 0,
+        (i * j) % 2 + (i * j) % 3 == 0,
+        ((i * j) % 2 + (i * j) % 3) % 2 == 0,
+        ((i * j) % 3 + (i + j) % 2) % 2 == 0,
+    ])
+
+
+def _penalties(candidates):
+    """util.lost_point() for a stack of module matrices, computed with array operations."""
+    count = candidates.shape[-1]
+    lines = np.concatenate((candidates, candidates.transpose(0, 2, 1)), axis=1)
+    axes = (1, 2)
+
+    # Runs of five or more same-coloured modules score (length - 2): one point
+    # per 5-module window inside the run plus two per run.
+    same = lines[:, :, 1:] == lines[:, :, :-1]
+    windows = same[:, :, :-3] & same[:, :, 1:-2] & same[:, :, 2:-1] & same[:, :, 3:]
+    run_starts = windows[:, :, 0].sum(axis=1) + (windows[:, :, 1:] & ~same[:, :, :-4]).sum(axis=axes)
+    lost_point = windows.sum(axis=axes) + 2 * run_starts
+
+    block = candidates[:, :-1, :-1]
+    lost_point += 3 * (
+        (block == candidates[:, 1:, :-1]) & (block == candidates[:, :-1, 1:]) & (block == candidates[:, 1:, 1:])
+    ).sum(axis=axes)
+
+    span = count - 10
+    for pattern in _FINDER_PATTERNS:
+        found = lines[:, :, :span] == pattern[0]
+        for offset in range(1, 11):
+            found &= lines[:, :, offset:offset + span] == pattern[offset]
+        lost_point += 40 * found.sum(axis=axes)
+
+    percent = candidates.sum(axis=axes) / float(count ** 2)
+    return lost_point + (np.abs(percent * 100 - 50) / 5).astype(int) * 10
+
+
+def _place_format(modules, version, error_correction, mask_pattern):
+    """Writes the format (and version) information, as QRCode.setup_type_info does."""
+    count = len(modules)
+    bits = util.BCH_type_info((error_correction << 3) | mask_pattern)
+    for i in range(15):
+        mod = ((bits >> i) & 1) == 1
+        modules[i if i < 6 else i + 1 if i < 8 else count - 15 + i, 8] = mod
+        modules[8, count - i - 1 if i < 8 else 15 - i if i < 9 else 15 - i - 1] = mod
+    modules[count - 8, 8] = True
+
+    if version >= 7:
+        bits = util.BCH_type_number(version)
+        for i in range(18):
+            mod = ((bits >> i) & 1) == 1
+            modules[i // 3, i % 3 + count - 8 - 3] = mod
+            modules[i % 3 + count - 8 - 3, i // 3] = mod
+
+
+def matrix(data, version=None, error_correction=ERROR_CORRECTION_DEFAULT, mask_pattern=None):
+    """Returns the module matrix of data (True = dark), without border.
+
+    version pins the symbol size (1-40); None picks the smallest that fits.
+    error_correction is one of "L", "M", "Q", "H". Raises
+    qrcode.exceptions.DataOverflowError if data does not fit.
+    """
+    level = ERROR_CORRECTION[error_correction]
+    data_list = list(util.optimal_data_chunks(data, minimum=20))  # as QRCode.add_data
+    if version is None:
+        version = _fit_version(data_list, level)
+    else:
+        util.check_version(version)
+
+    codewords = np.array(_codewords(version, level, data_list), dtype=np.uint8)
+    base, rows, cols = _layout(version)
+    bits = np.zeros(len(rows), dtype=bool)
+    data_bits = np.unpackbits(codewords).astype(bool)[:len(rows)]
+    bits[:len(data_bits)] = data_bits
+
+    candidates = np.repeat(base[None], 8, axis=0)
+    candidates[:, rows, cols] = bits ^ _masks(version)
+    if mask_pattern is None:
+        mask_pattern = int(np.argmin(_penalties(candidates)))  # first lowest, like qrcode
+
+    modules = candidates[mask_pattern]
+    _place_format(modules, version, level, mask_pattern)
+    return modules
+
+
+def rasterize(modules, box_size=BOX_SIZE, border=BORDER):
+    """Scales a module matrix to a 1-bit PIL image (black modules on white)."""
+    light = np.pad(~modules, border, constant_values=True)
+    pixels = light.repeat(box_size, axis=0).repeat(box_size, axis=1)
+    return Image.fromarray(pixels) if pixels.size else Image.new("1", (0, 0))
+
+
+def render(data, version=None, error_correction=ERROR_CORRECTION_DEFAULT, box_size=BOX_SIZE, border=BORDER):
+    """Renders data as a 1-bit PIL image; see matrix() for the options."""
+    return rasterize(matrix(data, version, error_correction), box_size, border)
+
+
+def svg(data, version=None, error_correction=ERROR_CORRECTION_DEFAULT, box_size=BOX_SIZE, border=BORDER):
+    """Renders data as an SVG document (bytes) sized like render().
+
+    Each run of dark modules is a one-module-wide stroke along its row's
+    centre line, moved to relative to the previous run: about half the size
+    of one rectangle per run.
+    """
+    modules = matrix(data, version, error_correction)
+    size = modules.shape[0] + 2 * border
+    # Row-major edges of the dark runs: each row has a start and an end per run.
+    padded = np.pad(modules, ((0, 0), (1, 1)))
+    rows, cols = np.nonzero(padded[:, 1:] != padded[:, :-1])
+    path = []
+    last_row, last_end = None, 0
+    for row, start, end in zip(rows[0::2].tolist(), cols[0::2].tolist(), cols[1::2].tolist()):
+        if row != last_row:
+            path.append(f"M{start + border} {row + border}.5h{end - start}")
+        else:
+            path.append(f"m{start - last_end} 0h{end - start}")
+        last_row, last_end = row, end
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{size * box_size}" height="{size * box_size}" '
+        f'viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="100%" height="100%" fill="#fff"/><path stroke="#000" d="{"".join(path)}"/></svg>'
+    ).encode("ascii")
+
+
+def render_many(payloads, version=None, error_correction=ERROR_CORRECTION_DEFAULT, box_size=BOX_SIZE, border=BORDER):
+    """Renders many payloads in one call; see matrix() for the options."""
+    return [rasterize(matrix(data, version, error_correction), box_size, border) for data in payloads]
+
+
+def warm_up(max_version=10):
+    """Fills the per-version caches (layouts, masks, RS tables) up to max_version.
+
+    Meant for a process that forks workers: they inherit the tables instead of
+    each building them during its first requests.
+    """
+    for version in range(1, max_version + 1):
+        _masks(version)
+        for level in ERROR_CORRECTION.values():
+            for block in base.rs_blocks(version, level):
+                _rs_table(block.total_count - block.data_count)
@@ -0,0 +1,153 @@
+"""Durable SQLite spool for write-behind uploads and inserts.
+
+Jobs are written to a local SQLite file before the request returns, so they
+survive worker restarts. Any worker process sharing the file can claim a job;
+a claim is a lease, so jobs held by a worker that died are picked up again once
+the lease expires. Each job records whether its object upload and its row
+insert have been committed, so a retry only repeats the step that failed.
+"""
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    unique_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    content_type TEXT NOT NULL,
+    extension TEXT NOT NULL,
+    image BLOB,
+    state TEXT NOT NULL DEFAULT 'pending',
+    uploaded INTEGER NOT NULL DEFAULT 0,
+    stored INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    lease_until REAL NOT NULL DEFAULT 0,
+    url TEXT,
+    render_options TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready_idx ON jobs (state, next_attempt_at);
+"""
+
+STATUS_FIELDS = ("unique_id", "kind", "state", "uploaded", "stored", "attempts", "url", "error", "created_at", "updated_at")
+
+
+class Spool:
+    """Job journal shared by all worker processes on this host."""
+
+    def __init__(self, path, lease_seconds=300):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        # Spools created before render_options was added.
+        if "render_options" not in {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}:
+            try:
+                conn.execute("ALTER TABLE jobs ADD COLUMN render_options TEXT")
+            except sqlite3.OperationalError:
+                pass  # another worker added it first
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, unique_id, kind, name, bucket, rendered, url, render_options=None):
+        now = time.time()
+        self._connection().execute(
+            "INSERT INTO jobs (unique_id, kind, name, bucket, content_type, extension, image, url, render_options, "
+            "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (unique_id, kind, name, bucket, rendered.content_type, rendered.extension, rendered.data, url,
+             render_options, now, now)
+        )
+
+    def claim(self):
+        """Leases the next job that is due, or returns None."""
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE (state IN ('pending', 'retrying') AND next_attempt_at <= ?) "
+                "OR (state = 'running' AND lease_until <= ?) ORDER BY next_attempt_at LIMIT 1",
+                (now, now)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET state = 'running', lease_until = ?, attempts = attempts + 1, updated_at = ? "
+                    "WHERE unique_id = ?",
+                    (now + self.lease_seconds, now, row["unique_id"])
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        job = dict(row)
+        job["attempts"] += 1
+        return job
+
+    def mark_uploaded(self, unique_id, url):
+        self._connection().execute(
+            "UPDATE jobs SET uploaded = 1, url = ?, updated_at = ? WHERE unique_id = ?",
+            (url, time.time(), unique_id)
+        )
+
+    def complete(self, unique_id):
+        # The image is no longer needed once both writes are committed.
+        self._connection().execute(
+            "UPDATE jobs SET state = 'done', stored = 1, image = NULL, error = NULL, updated_at = ? WHERE unique_id = ?",
+            (time.time(), unique_id)
+        )
+
+    def retry(self, unique_id, error, delay):
+        now = time.time()
+        self._connection().execute(
+            "UPDATE jobs SET state = 'retrying', error = ?, next_attempt_at = ?, lease_until = 0, updated_at = ? "
+            "WHERE unique_id = ?",
+            (error, now + delay, now, unique_id)
+        )
+
+    def fail(self, unique_id, error):
+        self._connection().execute(
+            "UPDATE jobs SET state = 'failed', error = ?, lease_until = 0, updated_at = ? WHERE unique_id = ?",
+            (error, time.time(), unique_id)
+        )
+
+    def status(self, unique_id):
+        row = self._connection().execute(
+            f"SELECT {', '.join(STATUS_FIELDS)} FROM jobs WHERE unique_id = ?", (unique_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        status = dict(row)
+        status["uploaded"] = bool(status["uploaded"])
+        status["stored"] = bool(status["stored"])
+        return status
+
+    def pending_image(self, unique_id):
+        """Returns kind, image and its type for a job whose row is not stored yet (and still may be)."""
+        row = self._connection().execute(
+            "SELECT kind, image, content_type, extension FROM jobs "
+            "WHERE unique_id = ? AND image IS NOT NULL AND state <> 'failed'",
+            (unique_id,)
+        ).fetchone()
+        return dict(row) if row is not None else None
+
+    def prune(self, older_than):
+        """Deletes finished jobs last updated more than older_than seconds ago."""
+        self._connection().execute(
+            "DELETE FROM jobs WHERE state = 'done' AND updated_at < ?", (time.time() - older_than,)
+        )
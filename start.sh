@@ -1,4 +1,10 @@
 #!/bin/bash
 
-/opt/render/project/src/.venv/bin/gunicorn -w 4 -b 0.0.0.0:8000 barcode_gen:app
+# Workers share metrics through this directory; stale files from a previous run would be summed in.
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/barcode_metrics}"
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
 
+# Also read by the app to split the CPUs between the workers' render pools.
+export WEB_CONCURRENCY="${WEB_CONCURRENCY:-4}"
+
+/opt/render/project/src/.venv/bin/gunicorn -c gunicorn.conf.py --preload -w "$WEB_CONCURRENCY" -b 0.0.0.0:8000 barcode_gen:app
@@ -0,0 +1,10 @@
+#!/bin/bash
+
+# Async (ASGI) alternative to start.sh: same routes, each worker holds many requests in flight.
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/barcode_metrics}"
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+# Also read by the app to split the CPUs between the workers' render pools.
+export WEB_CONCURRENCY="${WEB_CONCURRENCY:-4}"
+
+/opt/render/project/src/.venv/bin/gunicorn -c gunicorn.conf.py --preload -k uvicorn_worker.UvicornWorker -w "$WEB_CONCURRENCY" -b 0.0.0.0:8000 barcode_asgi:app
@@ -0,0 +1,58 @@
+"""code128 against python-barcode, which it replaces: same symbols, same pixels."""
+import random
+
+import barcode
+import numpy as np
+import pytest
+from barcode.writer import ImageWriter
+
+import code128
+
+Code128 = barcode.get_barcode_class("code128")
+
+# Printable ASCII, digit runs (charset C), control characters (charset A only)
+# and lowercase (charset B only), mixed so values switch charsets.
+ALPHABETS = (
+    "".join(chr(c) for c in range(0x20, 0x7f)),
+    "0123456789",
+    "".join(chr(c) for c in range(0x20)) + "ABC",
+    "abcxyz{|}~\x7f",
+)
+
+
+def random_values(seed, count):
+    rng = random.Random(seed)
+    values = []
+    while len(values) < count:
+        parts = [
+            "".join(rng.choice(rng.choice(ALPHABETS)) for _ in range(rng.randint(1, 8)))
+            for _ in range(rng.randint(1, 4))
+        ]
+        value = "".join(parts)
+        if not value.startswith("99"):  # see test_leading_99_is_kept
+            values.append(value)
+    return values
+
+
+def test_symbols_match_python_barcode():
+    for value in random_values(128, 1500):
+        # python-barcode's _build() stops before the checksum.
+        assert code128.encode(value)[:-1] == Code128(value)._build(), repr(value)
+
+
+@pytest.mark.parametrize("value", random_values(1280, 300))
+def test_render_matches_image_writer(value):
+    expected = np.asarray(Code128(value, writer=ImageWriter()).render().convert("L"))
+    assert np.array_equal(np.asarray(code128.render(value)), expected)
+
+
+def test_leading_99_is_kept():
+    # python-barcode folds a leading "99" pair into the start code, as if it
+    # were a charset switch, so "9912" scans as "12". The encoder keeps it.
+    assert Code128("9912")._build() == [code128.START_C, 12]
+    assert code128.encode("9912")[:-1] == [code128.START_C, 99, 12]
+
+
+def test_rejects_characters_outside_code128():
+    with pytest.raises(ValueError):
+        code128.encode("é")
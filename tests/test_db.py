@@ -0,0 +1,116 @@
+"""db.ConnectionPool and GroupCommitWriter on benchmark's in-memory Postgres stand-in."""
+import threading
+
+import psycopg2
+import pytest
+
+import benchmark
+import db
+
+INSERT_SQL = "INSERT INTO items (unique_id, name) VALUES %s ON CONFLICT DO NOTHING"
+
+
+class FlakyDatabase(benchmark.FakeDatabase):
+    """Rejects any INSERT that contains a row named "bad"."""
+
+    def insert(self, table, columns, rows):
+        if any(dict(zip(columns, row))["name"] == "bad" for row in rows):
+            raise psycopg2.IntegrityError("bad row")
+        super().insert(table, columns, rows)
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = FlakyDatabase()
+    monkeypatch.setattr(psycopg2, "connect", database.connect)
+    return database
+
+
+def make_pool(maxconn=2, **kwargs):
+    return db.ConnectionPool(1, maxconn, checkout_timeout=0.1, **kwargs)
+
+
+def test_pool_returns_slots_of_discarded_connections(database):
+    connection_pool = make_pool()
+    for _ in range(5):
+        with pytest.raises(psycopg2.OperationalError):
+            with connection_pool.connection():
+                raise psycopg2.OperationalError("server closed the connection")
+    stats = connection_pool.stats()
+    assert stats["in_use"] == 0
+    assert stats["discarded"] == 5
+
+    # Every slot is still usable: maxconn checkouts succeed, one more waits and times out.
+    conns = [connection_pool.getconn() for _ in range(connection_pool.maxconn)]
+    with pytest.raises(db.PoolTimeout):
+        connection_pool.getconn()
+    for conn in conns:
+        connection_pool.putconn(conn)
+    assert connection_pool.stats()["in_use"] == 0
+    assert connection_pool.stats()["timeouts"] == 1
+
+
+def test_pool_replaces_closed_connections(database):
+    connection_pool = make_pool(maxconn=1)
+    conn = connection_pool.getconn()
+    connection_pool.putconn(conn)
+    conn.closed = 1  # dropped by the server while idle
+
+    fresh = connection_pool.getconn()
+    assert fresh is not conn
+    assert not fresh.closed
+    connection_pool.putconn(fresh)
+    assert connection_pool.stats() == {
+        "max": 1, "in_use": 0, "checkouts": 2, "waits": 0, "timeouts": 0, "discarded": 1,
+    }
+
+
+def test_pool_keeps_connections_after_other_errors(database):
+    connection_pool = make_pool(maxconn=1)
+    with pytest.raises(ValueError):
+        with connection_pool.connection() as conn:
+            raise ValueError("not a connection problem")
+    with connection_pool.connection() as again:
+        assert again is conn
+    assert connection_pool.stats()["discarded"] == 0
+
+
+def test_pool_waits_for_a_free_connection(database):
+    connection_pool = make_pool(maxconn=1)
+    connection_pool.checkout_timeout = 5
+    conn = connection_pool.getconn()
+    threading.Timer(0.05, connection_pool.putconn, (conn,)).start()
+    connection_pool.putconn(connection_pool.getconn())
+    assert connection_pool.stats()["waits"] == 1
+    assert connection_pool.stats()["in_use"] == 0
+
+
+def test_group_commit_batches_concurrent_writes(database):
+    writer = db.GroupCommitWriter(make_pool(), INSERT_SQL, max_delay=0.05)
+    futures = [writer.submit((f"id{i}", f"name{i}")) for i in range(20)]
+    assert all(future.result(5) for future in futures)
+    assert set(database.tables["items"]) == {f"id{i}" for i in range(20)}
+    assert writer.rows == 20
+    assert writer.batches < 20
+    assert database.commits == writer.batches
+
+
+def test_group_commit_failed_batch_only_fails_bad_rows(database):
+    connection_pool = make_pool()
+    writer = db.GroupCommitWriter(connection_pool, INSERT_SQL, max_delay=0.05)
+    names = ["good0", "bad", "good1", "good2"]
+    futures = [writer.submit((f"id{i}", name)) for i, name in enumerate(names)]
+    assert [future.result(5) for future in futures] == [True, False, True, True]
+    assert set(database.tables["items"]) == {"id0", "id2", "id3"}
+    assert writer.rows == 3
+    # The failed batch and the bad row's retry rolled back but kept their connections.
+    assert connection_pool.stats()["in_use"] == 0
+    assert connection_pool.stats()["discarded"] == 0
+
+
+def test_group_commit_single_bad_row(database):
+    writer = db.GroupCommitWriter(make_pool(), INSERT_SQL, max_delay=0)
+    assert writer.write(("id0", "bad")) is False
+    assert writer.write(("id1", "good")) is True
+    assert list(database.tables["items"]) == ["id1"]
+
@@ -0,0 +1,116 @@
+"""export: the streamed ZIP, PDF and NDJSON documents are complete and well-formed."""
+import io
+import json
+import re
+import zipfile
+import zlib
+
+from PIL import Image
+
+import export
+
+
+def label(width, height, value=0):
+    return Image.new("L", (width, height), value)
+
+
+def test_ndjson():
+    records = [{"unique_id": "a", "url": "https://x/a.png"}, {"unique_id": "b", "error": "Failed to upload"}]
+    lines = list(export.ndjson(records))
+    assert all(line.endswith("\n") for line in lines)
+    assert [json.loads(line) for line in lines] == records
+
+
+def test_zip_archive_streams_valid_archive():
+    files = [(f"{i}.png", bytes([i]) * (i * 1000 + 1)) for i in range(5)]
+    chunks = []
+    produced = 0
+
+    def lazily():
+        nonlocal produced
+        for item in files:
+            produced += 1
+            yield item
+
+    for chunk in export.zip_archive(lazily()):
+        chunks.append(chunk)
+        # Each file's bytes are out before the next file is read.
+        assert produced <= len(chunks)
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == [filename for filename, _ in files]
+        for filename, data in files:
+            assert archive.read(filename) == data
+            assert archive.getinfo(filename).compress_type == zipfile.ZIP_STORED
+
+
+def test_zip_archive_empty():
+    with zipfile.ZipFile(io.BytesIO(b"".join(export.zip_archive([])))) as archive:
+        assert archive.namelist() == []
+
+
+def test_tile_pages_fills_pages_in_order():
+    width, height = export.PAGE_SIZES["A4"]
+    usable = width - 2 * export.PAGE_MARGIN
+    per_row = (usable + export.LABEL_GAP) // (600 + export.LABEL_GAP)
+    pages = list(export.tile_pages(label(600, 1000) for _ in range(per_row * 3 + 1)))
+    assert len(pages) == 2  # three rows of 1000 px fit on A4, the fourth starts a page
+    assert all(page.mode == "1" and page.size == (width, height) for page in pages)
+    # The first label's top-left corner is black, the margin white.
+    assert pages[0].getpixel((export.PAGE_MARGIN, export.PAGE_MARGIN)) == 0
+    assert pages[0].getpixel((export.PAGE_MARGIN - 1, export.PAGE_MARGIN)) == 255
+
+
+def test_tile_pages_shrinks_oversized_labels():
+    pages = list(export.tile_pages([label(5000, 200)]))
+    assert len(pages) == 1
+    assert pages[0].getbbox() is not None
+
+
+def test_tile_pages_empty_gives_one_blank_page():
+    pages = list(export.tile_pages([]))
+    assert len(pages) == 1
+
+
+def pdf_objects(document):
+    """Checks the cross-reference table; returns {object number: bytes of the object}."""
+    startxref = int(re.search(rb"startxref\n(\d+)\n%%EOF\n$", document).group(1))
+    assert document[startxref:].startswith(b"xref\n")
+    size = int(re.search(rb"/Size (\d+)", document[startxref:]).group(1))
+    entries = re.findall(rb"(\d{10}) (\d{5}) ([nf]) \n", document[startxref:])
+    assert len(entries) == size
+    objects = {}
+    for number, (offset, _, kind) in enumerate(entries):
+        if kind == b"n":
+            offset = int(offset)
+            assert document[offset:].startswith(f"{number} 0 obj\n".encode("ascii"))
+            objects[number] = document[offset:document.index(b"\nendobj\n", offset)]
+    return objects
+
+
+def test_pdf_sheets_is_a_valid_pdf():
+    labels = [label(600, 1000, value=i * 40) for i in range(13)]
+    pages = list(export.tile_pages(labels))
+    document = b"".join(export.pdf_sheets(labels))
+    assert document.startswith(b"%PDF-1.4\n")
+
+    objects = pdf_objects(document)
+    assert b"/Type /Catalog /Pages 2 0 R" in objects[1]
+    kids = [int(kid) for kid in re.findall(rb"(\d+) 0 R", re.search(rb"/Kids \[([^\]]*)\]", objects[2]).group(1))]
+    assert len(kids) == len(pages) == int(re.search(rb"/Count (\d+)", objects[2]).group(1))
+
+    for kid, page in zip(kids, pages):
+        assert b"/Type /Page " in objects[kid]
+        image_number = int(re.search(rb"/Im0 (\d+) 0 R", objects[kid]).group(1))
+        image = objects[image_number]
+        assert f"/Width {page.width} /Height {page.height}".encode("ascii") in image
+        length = int(re.search(rb"/Length (\d+)", image).group(1))
+        stream = image[image.index(b"\nstream\n") + len(b"\nstream\n"):]
+        assert len(stream) == length + len(b"\nendstream")
+        assert zlib.decompress(stream[:length]) == page.tobytes()
+
+
+def test_pdf_page_size_matches_dpi():
+    document = b"".join(export.pdf_sheets([label(100, 100)], page_size=export.PAGE_SIZES["letter"]))
+    # 2550 x 3300 px at 300 dpi is 8.5 x 11 in.
+    assert b"/MediaBox [0 0 612.00 792.00]" in document
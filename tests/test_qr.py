@@ -0,0 +1,51 @@
+"""qr against qrcode, which it replaces: same symbols for every option."""
+import random
+
+import numpy as np
+import pytest
+import qrcode
+from qrcode.exceptions import DataOverflowError
+
+import qr
+
+ALPHABETS = (
+    "".join(chr(c) for c in range(0x20, 0x7f)),
+    "0123456789",  # numeric mode
+    "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:",  # alphanumeric mode
+    "äöüßé€",  # multi-byte UTF-8
+)
+
+
+def random_payloads(seed, count):
+    rng = random.Random(seed)
+    payloads = []
+    for _ in range(count):
+        data = "".join(rng.choice(rng.choice(ALPHABETS)) for _ in range(rng.randint(1, 120)))
+        version = rng.choice((None, None, rng.randint(1, 12)))
+        payloads.append((data, version, rng.choice("LMQH"), rng.randint(1, 4), rng.randint(0, 4)))
+    return payloads
+
+
+def qrcode_image(data, version, error_correction, box_size, border):
+    code = qrcode.QRCode(version=version, error_correction=qr.ERROR_CORRECTION[error_correction],
+                         box_size=box_size, border=border)
+    code.add_data(data)
+    code.make(fit=version is None)
+    return np.asarray(code.make_image().get_image())
+
+
+@pytest.mark.parametrize("data, version, error_correction, box_size, border", random_payloads(5, 300))
+def test_render_matches_qrcode(data, version, error_correction, box_size, border):
+    try:
+        expected = qrcode_image(data, version, error_correction, box_size, border)
+    except DataOverflowError:
+        with pytest.raises(DataOverflowError):
+            qr.matrix(data, version, error_correction)
+        return
+    image = qr.render(data, version, error_correction, box_size, border)
+    assert np.array_equal(np.asarray(image), expected)
+
+
+def test_default_matches_qrcode_make():
+    expected = np.asarray(qrcode.make("https://example.com/p/12345").get_image())
+    assert np.array_equal(np.asarray(qr.render("https://example.com/p/12345")), expected)
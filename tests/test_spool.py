@@ -0,0 +1,121 @@
+"""spool.Spool: claims, leases, retries and failures of write-behind jobs."""
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import spool
+
+PNG = SimpleNamespace(data=b"\x89PNG image", content_type="image/png", extension="png")
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "spool.sqlite3")
+
+
+def enqueue(job_spool, unique_id, **kwargs):
+    job_spool.enqueue(unique_id, "barcode", "name", "barcodes_new", PNG, f"https://storage/{unique_id}.png", **kwargs)
+
+
+def test_claim_leases_each_job_once(path):
+    job_spool = spool.Spool(path)
+    enqueue(job_spool, "a")
+    enqueue(job_spool, "b")
+    other_worker = spool.Spool(path)
+
+    claimed = {job_spool.claim()["unique_id"], other_worker.claim()["unique_id"]}
+    assert claimed == {"a", "b"}
+    assert job_spool.claim() is None
+    assert other_worker.claim() is None
+    assert job_spool.status("a")["state"] == "running"
+
+
+def test_claim_returns_the_job(path):
+    job_spool = spool.Spool(path)
+    enqueue(job_spool, "a", render_options='{"box_size":3}')
+    job = job_spool.claim()
+    assert job["kind"] == "barcode"
+    assert job["image"] == PNG.data
+    assert job["content_type"] == "image/png"
+    assert job["render_options"] == '{"box_size":3}'
+    assert job["attempts"] == 1
+
+
+def test_expired_lease_is_claimed_again(path):
+    job_spool = spool.Spool(path, lease_seconds=0)
+    enqueue(job_spool, "a")
+    assert job_spool.claim()["attempts"] == 1
+    # The first worker died holding the lease.
+    job = spool.Spool(path).claim()
+    assert job["unique_id"] == "a"
+    assert job["attempts"] == 2
+
+
+def test_retry_waits_for_its_delay(path):
+    job_spool = spool.Spool(path)
+    enqueue(job_spool, "a")
+    job_spool.claim()
+    job_spool.retry("a", "Failed to upload", delay=60)
+    assert job_spool.claim() is None
+    status = job_spool.status("a")
+    assert status["state"] == "retrying"
+    assert status["error"] == "Failed to upload"
+
+    job_spool.retry("a", "Failed to upload", delay=0)
+    assert job_spool.claim()["attempts"] == 2
+
+
+def test_mark_uploaded_is_kept_across_retries(path):
+    job_spool = spool.Spool(path)
+    enqueue(job_spool, "a")
+    job_spool.claim()
+    job_spool.mark_uploaded("a", "https://storage/a.png")
+    job_spool.retry("a", "Failed to store in database", delay=0)
+    job = job_spool.claim()
+    assert job["uploaded"] == 1
+    assert job["stored"] == 0
+    assert job_spool.status("a")["uploaded"] is True
+
+
+def test_pending_image_until_complete(path):
+    job_spool = spool.Spool(path)
+    enqueue(job_spool, "a")
+    assert job_spool.pending_image("a") == {
+        "kind": "barcode", "image": PNG.data, "content_type": "image/png", "extension": "png",
+    }
+    job_spool.claim()
+    job_spool.complete("a")
+    assert job_spool.pending_image("a") is None
+    status = job_spool.status("a")
+    assert status["state"] == "done"
+    assert status["stored"] is True
+    assert status["error"] is None
+
+
+def test_failed_job_is_not_claimed_or_served(path):
+    job_spool = spool.Spool(path)
+    enqueue(job_spool, "a")
+    job_spool.claim()
+    job_spool.fail("a", "Failed to upload")
+    assert job_spool.claim() is None
+    assert job_spool.pending_image("a") is None
+    assert job_spool.status("a")["state"] == "failed"
+
+
+def test_prune_only_deletes_old_finished_jobs(path):
+    job_spool = spool.Spool(path)
+    for unique_id in ("done", "failed", "pending"):
+        enqueue(job_spool, unique_id)
+    job_spool.complete("done")
+    job_spool.fail("failed", "Failed to upload")
+
+    job_spool.prune(older_than=60)
+    assert job_spool.status("done") is not None
+
+    time.sleep(0.01)
+    job_spool.prune(older_than=0)
+    assert job_spool.status("done") is None
+    assert job_spool.status("failed")["state"] == "failed"
+    assert job_spool.status("pending")["state"] == "pending"
+    assert job_spool.status("missing") is None